@@ -0,0 +1,212 @@
+import argparse
+import contextlib
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SRC_FLD = Path(__file__).absolute().parent.parent / 'src'
+sys.path.insert(0, str(SRC_FLD))
+
+from etl import FLIGHTS_COLUMNS, export_chunks
+from store import EXPORT_TABLES, convert_export, read_export
+
+# Rows of the exported flights fact table (scale 1)
+BASE_ROWS = 650_000
+DIMENSION_TABLES = [name for name in EXPORT_TABLES if name != 'flights']
+
+
+def synthesize_flights(export_fld, rows, seed=0, chunksize=1_000_000):
+    '''Random fact table with the schema of flights.zip: monthly dates and the airport/airline ids of the dimension tables'''
+    rng = np.random.default_rng(seed)
+    dates = read_export(export_fld, 'dates', ['id', 'day'])
+    date_ids = dates.loc[dates['day'] == 1, 'id'].to_numpy()
+    airports = read_export(export_fld, 'airports', ['id', 'coutry_id'])
+    usa_ids = airports.loc[airports['coutry_id'] == 'US', 'id'].to_numpy()
+    foreign_ids = airports.loc[airports['coutry_id'] != 'US', 'id'].to_numpy()
+    # Traffic concentrates on a subset of the airlines, as in the real data
+    airline_ids = rng.choice(read_export(export_fld, 'airlines', ['id'])['id'].to_numpy(), 1000, replace=False)
+
+    def chunks():
+        for start in range(0, rows, chunksize):
+            n = min(chunksize, rows - start)
+            psg = rng.integers(0, 2000, (n, 2))
+            dep = rng.integers(0, 100, (n, 2))
+            yield pd.DataFrame({
+                'date_id': rng.choice(date_ids, n),
+                'airport_usa_id': rng.choice(usa_ids, n),
+                'airport_foreign_id': rng.choice(foreign_ids, n),
+                'airline_id': rng.choice(airline_ids, n),
+                'us_foreign_airline': rng.integers(0, 2, n),
+                'psg_scheduled_flights': psg[:, 0],
+                'psg_charter_flights': psg[:, 1],
+                'psg_total_flights': psg.sum(axis=1),
+                'dep_scheduled_flights': dep[:, 0],
+                'dep_charter_flights': dep[:, 1],
+                'dep_total_flights': dep.sum(axis=1),
+            })[FLIGHTS_COLUMNS]
+
+    return export_chunks(chunks(), export_fld / 'flights.zip', 'flights.csv')
+
+
+def prepare(work_fld, dims_fld, scale, store=True):
+    '''Export folder with the dimension tables and a synthetic fact table of scale x BASE_ROWS rows (and its store)'''
+    export_fld = work_fld / 'Export'
+    store_fld = work_fld / 'Store'
+    export_fld.mkdir(parents=True, exist_ok=True)
+    for name in DIMENSION_TABLES:
+        shutil.copy(dims_fld / f"{name}.zip", export_fld)
+    synthesize_flights(export_fld, int(scale * BASE_ROWS))
+    if store:
+        # Progress to stderr, stdout is the report
+        with contextlib.redirect_stdout(sys.stderr):
+            convert_export(export_fld, store_fld)
+    return export_fld, store_fld
+
+
+def timed(timings, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings[name] = time.perf_counter() - start
+    return result
+
+
+def measure(export_fld, store_fld, engine_name='pandas'):
+    '''Timings (seconds) of the data load, the scenario computations (cold caches) and their figures'''
+    from analytics import QUERY_CACHE, RESULT_CACHE, airline_traffic, average_flights, busiest_airports, load_data, traffic_correlation, us_foreign_share
+    from part_a import FIGURE_CACHE, PartA
+
+    # Cold computations: no precomputed results of the app
+    RESULT_CACHE.fld = None
+    timings = {}
+    # Loaded from the tables, not from the mapped columns of the app (DIT161_MMAP)
+    data = timed(timings, 'load_analysis_data', load_data, store_fld, export_fld, engine_name, None)
+    QUERY_CACHE.clear()
+    FIGURE_CACHE.clear()
+    options = timed(timings, 'airline_options', PartA.airline_options, data)
+    min_year, max_year = timed(timings, 'year_range', PartA.year_range, data)
+    airline_id = options[0].split('|')[0].strip()
+
+    timed(timings, 'sc1', busiest_airports, data, min_year, max_year, 5)
+    timed(timings, 'sc1_figures', PartA.airports_figures, data, min_year, max_year, 5)
+    timed(timings, 'sc2', average_flights, data, airline_id, min_year, max_year, 'month', 'total')
+    timed(timings, 'sc2_figures', PartA.flight_types_figure, data, airline_id, min_year, max_year, 'month', 'total')
+    timed(timings, 'sc3', us_foreign_share, data, min_year, max_year)
+    timed(timings, 'sc3_figures', PartA.us_foreign_figures, data, min_year, max_year)
+    timed(timings, 'sc4_correlation', traffic_correlation, data)
+    timed(timings, 'sc4', airline_traffic, data, (0, 1), 0.5, 5)
+    # Warm: same widget values again (cache hits)
+    timed(timings, 'sc1_warm', PartA.airports_figures, data, min_year, max_year, 5)
+    return {'timings': timings}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 ** 2 if sys.platform == 'darwin' else rss / 1024
+
+
+def run_scale(scale, dims_fld, repeat, store, engine_name='pandas', keep=None):
+    '''Benchmark of a scale in a child process each repeat, so peak RSS and cold timings are per run'''
+    work_fld = Path(keep) if keep else Path(tempfile.mkdtemp(prefix=f"bench_{scale}x_"))
+    try:
+        start = time.perf_counter()
+        export_fld, store_fld = prepare(work_fld, dims_fld, scale, store)
+        prepare_seconds = time.perf_counter() - start
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run(
+                [sys.executable, __file__, 'measure', str(export_fld), str(store_fld), '--engine', engine_name],
+                check=True, capture_output=True, text=True,
+            )
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    finally:
+        if not keep:
+            shutil.rmtree(work_fld, ignore_errors=True)
+    timings = pd.DataFrame([r['timings'] for r in runs])
+    return {
+        'scale': scale,
+        'rows': int(scale * BASE_ROWS),
+        'store': store,
+        'engine': engine_name,
+        'repeat': repeat,
+        'prepare_seconds': prepare_seconds,
+        # Best of the repeats (least noisy), all runs for the spread
+        'timings': timings.min().to_dict(),
+        'timings_runs': timings.to_dict(orient='list'),
+        'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+    }
+
+
+def compare(baseline, report, tolerance):
+    '''Timings and peak RSS of the report more than `tolerance` (fraction) above the baseline, per scale'''
+    baseline_results = {r['scale']: r for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        base = baseline_results.get(result['scale'])
+        if base is None:
+            continue
+        metrics = [(f"timings.{name}", value, base['timings'].get(name)) for name, value in result['timings'].items()]
+        metrics.append(('peak_rss_mb', result['peak_rss_mb'], base['peak_rss_mb']))
+        for name, value, base_value in metrics:
+            if base_value and value > base_value * (1 + tolerance):
+                regressions.append({'scale': result['scale'], 'metric': name, 'baseline': base_value, 'value': value})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Part A load time, scenario latency and memory benchmarks on synthetic fact tables')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='Benchmark the given scales (default)')
+    run_parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100], help=f"Fact table sizes in multiples of {BASE_ROWS} rows")
+    run_parser.add_argument('--repeat', type=int, default=3, help='Runs per scale')
+    run_parser.add_argument('--dims-fld', type=Path, default=Path().absolute() / 'Data' / 'Part-A' / 'Export', help='Folder with the exported dimension tables')
+    run_parser.add_argument('--no-store', action='store_true', help='Load from the zipped csv tables instead of the parquet store')
+    run_parser.add_argument('--engine', choices=['pandas', 'duckdb'], default='pandas', help='Query engine')
+    run_parser.add_argument('--keep', help='Folder to keep the synthetic tables in (one scale only)')
+    run_parser.add_argument('--output', type=Path, help='Output json file (default stdout)')
+    compare_parser = subparsers.add_parser('compare', help='Exit with an error if a report regressed against a baseline report')
+    compare_parser.add_argument('baseline', type=Path)
+    compare_parser.add_argument('report', type=Path)
+    compare_parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed increase (fraction) of each metric')
+    measure_parser = subparsers.add_parser('measure', help='One measurement on prepared tables (used by run)')
+    measure_parser.add_argument('export_fld', type=Path)
+    measure_parser.add_argument('store_fld', type=Path)
+    measure_parser.add_argument('--engine', default='pandas')
+    args = parser.parse_args(sys.argv[1:] or ['run'])
+
+    if args.command == 'measure':
+        result = measure(args.export_fld, args.store_fld, args.engine)
+        result['peak_rss_mb'] = peak_rss_mb()
+        print(json.dumps(result))
+    elif args.command == 'compare':
+        regressions = compare(json.loads(args.baseline.read_text()), json.loads(args.report.read_text()), args.tolerance)
+        print(json.dumps(regressions, indent=2))
+        sys.exit(1 if regressions else 0)
+    else:
+        if args.keep and len(args.scales) > 1:
+            parser.error('--keep takes one scale')
+        report = {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'base_rows': BASE_ROWS,
+            'results': [],
+        }
+        for scale in args.scales:
+            result = run_scale(scale, args.dims_fld, args.repeat, not args.no_store, args.engine, args.keep)
+            report['results'].append(result)
+            print(f"{scale}x: {result['rows']} rows, load {result['timings']['load_analysis_data']:.2f}s, peak {result['peak_rss_mb']:.0f}MB", file=sys.stderr)
+        output = json.dumps(report, indent=2)
+        if args.output:
+            args.output.write_text(output, encoding='utf-8')
+        else:
+            print(output)
@@ -0,0 +1,267 @@
+import argparse
+import itertools
+import json
+import os
+import warnings
+from pathlib import Path
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import pandas as pd
+
+from cache import DiskCache, LRUCache, memoize
+import engine
+import mmap_store
+from dataset import AnalysisData
+from perf import stage
+from store import EXPORT_TABLES, delta_parts, load_tables, scenario_columns, source_fingerprint
+
+# Scenario results keyed by the analysis data and the widget values
+QUERY_CACHE = LRUCache('part_a_queries', maxsize=256, ttl=60 * 60)
+# Persistent scenario results (written by precompute.py, read-only in the app), consulted after QUERY_CACHE if the folder exists
+RESULTS_FLD = Path(os.environ.get('DIT161_RESULTS', Path().absolute() / 'Data' / 'Part-A' / 'Results'))
+RESULT_CACHE = DiskCache('part_a_results', RESULTS_FLD)
+# Memory mapped fact table shared by the processes of the host (see mmap_store.py), used if the folder exists
+MMAP_FLD = Path(os.environ.get('DIT161_MMAP', Path().absolute() / 'Data' / 'Part-A' / 'Mmap'))
+
+PERIOD_TYPES = ('month', 'season')
+FLIGHT_TYPES = ('charter', 'scheduled', 'total')
+AIRLINE_GROUPS = {'US': 1, 'Foreign': 0}
+# Query engine: pandas (in memory cubes) or duckdb (SQL over the parquet store, see engine.py)
+ENGINES = ('pandas', 'duckdb')
+DEFAULT_ENGINE = os.environ.get('DIT161_ENGINE', 'pandas')
+
+
+def load_data(store_fld: Path, export_fld: Path, engine_name: str = DEFAULT_ENGINE, mmap_fld: Path = MMAP_FLD) -> AnalysisData:
+    '''Analysis data from the parquet store (with its incremental parts) or the exported csv tables.
+       Reads only the fact table columns used by the scenarios.
+       With the duckdb engine the fact table stays on disk (engine.SqlData, same interface), falling
+       back to pandas if duckdb is not installed or the tables are not converted to the store.
+       With pandas, if the mmap_fld folder exists the decoded fact table is mapped from it (saved there first if needed)
+    '''
+    if engine_name not in ENGINES:
+        raise ValueError(f"Unknown engine {engine_name!r}, expected one of {', '.join(ENGINES)}")
+    parts = delta_parts(store_fld, 'flights')
+    source = source_fingerprint(store_fld, export_fld)
+    if engine_name == 'duckdb':
+        if engine.available(store_fld):
+            with stage('load.sql'):
+                return engine.SqlData(store_fld, parts, source)
+        warnings.warn('duckdb engine needs the duckdb package and the parquet store, using pandas')
+
+    mapped = mmap_fld is not None and mmap_fld.is_dir()
+    if mapped:
+        with stage('load.mmap'):
+            dimensions = load_tables(store_fld, export_fld, tables=[name for name in EXPORT_TABLES if name != 'flights'])
+            data = mmap_store.load(mmap_fld, dimensions, parts, source)
+        if data is not None:
+            return data
+    with stage('load.tables') as info:
+        tables = load_tables(store_fld, export_fld, columns={'flights': scenario_columns()}, parts={'flights': parts})
+        info['rows'] = len(tables['flights'])
+    data = AnalysisData(tables, parts, source)
+    if mapped:
+        # Save for the other processes and use the mapped copy here too
+        with stage('save.mmap'):
+            mmap_store.save(mmap_fld, data, mmap_store.source_location(store_fld, export_fld))
+        return mmap_store.load(mmap_fld, dimensions, parts, source)
+    return data
+
+
+@memoize(QUERY_CACHE, RESULT_CACHE)
+def busiest_airports(data: AnalysisData, min_year: int, max_year: int, nlargest: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    '''Scenario 1: US airports with the most passengers in [min_year, max_year]
+       Returns (totals, totals per year) of the top airports
+    '''
+    with stage('sc1.airport_totals') as info:
+        # Year range totals from the prefix sums, no pass over the airport/year rows
+        df_grouped_tot = data.airport_totals(min_year, max_year)
+        info['rows'] = len(df_grouped_tot)
+    with stage('sc1.top', rows=len(df_grouped_tot)):
+        df_grouped_tot = df_grouped_tot.nlargest(nlargest, 'psg_total_flights').reset_index()
+        df_grouped_tot['airport_name'] = df_grouped_tot['airport_usa_id'].map(data.lookups['airport_names'])
+        df_grouped_tot = df_grouped_tot.rename(columns={'psg_total_flights':'Passengers (N)', 'airport_usa_id':'Airports'})
+
+    with stage('sc1.by_year') as info:
+        # Yearly rows of the top airports only
+        df_grouped_year = data.airport_year(min_year, max_year, df_grouped_tot['Airports']).reset_index()
+        info['rows'] = len(df_grouped_year)
+        df_grouped_year['airport_usa_id'] = df_grouped_year['airport_usa_id'].cat.remove_unused_categories()
+        df_grouped_year = df_grouped_year.rename(columns={'year':'Year', 'psg_total_flights':'Passengers (N)', 'airport_usa_id':'Airports'})
+        airport_dict = pd.Series(df_grouped_tot['Airports'].index.values, index=df_grouped_tot['Airports'])
+        df_grouped_year['sort'] = df_grouped_year['Airports'].map(airport_dict)
+        df_grouped_year = df_grouped_year.sort_values(['sort', 'Year']).drop(columns='sort')
+    return df_grouped_tot, df_grouped_year
+
+
+@memoize(QUERY_CACHE, RESULT_CACHE)
+def average_flights(data: AnalysisData, airline_id: str, min_year: int, max_year: int, period_type: str, flight_type: str) -> pd.DataFrame:
+    '''Scenario 2: average flights of an airline per period (month/season) in [min_year, max_year]
+       period_type: month or season, flight_type: charter, scheduled or total
+    '''
+    if period_type not in PERIOD_TYPES or flight_type not in FLIGHT_TYPES:
+        raise ValueError(f"Invalid period type {period_type!r} or flight type {flight_type!r}")
+    with stage('sc2.airline_slice') as info:
+        df = data.airline_period(airline_id, min_year, max_year)[[f"dep_{flight_type}_flights"]]
+        info['rows'] = len(df)
+    with stage('sc2.groupby_period', rows=len(df)):
+        df_grouped = df.groupby([period_type, 'year']).sum().groupby(period_type).mean().round(0).applymap(int).reset_index()
+    # Period (month/season) ids to names
+    df_grouped[period_type] = df_grouped[period_type].map(data.lookups[f"{period_type}_names"])
+    y_axis = f"{flight_type.title()} (avg)"
+    df_grouped = df_grouped.rename(columns={
+        period_type: period_type.title(),
+        f"dep_{flight_type}_flights": y_axis,
+    })
+    return df_grouped.sort_values(y_axis, ascending=False)
+
+
+@memoize(QUERY_CACHE, RESULT_CACHE)
+def us_foreign_share(data: AnalysisData, min_year: int, max_year: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    '''Scenario 3: US/Foreign airline flights in [min_year, max_year]
+       Returns (counts and percents per year, total counts)
+    '''
+    with stage('sc3.year_percents'):
+        df_grouped = data.year_us_foreign(min_year, max_year).reset_index()
+        df_grouped.insert(1, 'US/Foreign', df_grouped.pop('us_foreign_airline').map({0:'Foreign', 1:'US'}))
+        df_grouped = df_grouped.sort_values('US/Foreign', ascending=False)
+        df_grouped['US/Foreign (%)'] = (100 * df_grouped['count'] / df_grouped.groupby('year')['count'].transform('sum')).round(0)
+
+    with stage('sc3.totals', rows=len(df_grouped)):
+        df_total = df_grouped[['US/Foreign', 'count']].groupby(['US/Foreign']).sum().reset_index().sort_values('US/Foreign', ascending=False)
+    return df_grouped, df_total
+
+
+@memoize(QUERY_CACHE, RESULT_CACHE)
+def traffic_correlation(data: AnalysisData) -> pd.DataFrame:
+    '''Scenario 4: correlation of passengers and flights'''
+    with stage('sc4.correlation'):
+        labels = {'psg_total_flights':'passengers', 'dep_total_flights':'flights'}
+        return data.traffic_correlation().rename(index=labels, columns=labels).rename_axis('variable')
+
+
+@memoize(QUERY_CACHE, RESULT_CACHE)
+def airline_traffic(data: AnalysisData, airline_selection: Sequence[int], pass_wgt: float, nlargest: int) -> pd.DataFrame:
+    '''Scenario 4: airlines with the most traffic, defined as
+       pass_wgt * passengers + (1 - pass_wgt) * flights (min-max normalized)
+       airline_selection: us_foreign_airline values to include (1: US, 0: Foreign)
+    '''
+    dep_wgt = 1 - pass_wgt
+    df = data.airline_traffic(airline_selection)
+
+    with stage('sc4.normalize', rows=len(df)):
+        # min-max normalization (sum of normalized values per airline from sum, count, min, max)
+        psg, dep = df['psg_total_flights'], df['dep_total_flights']
+        col1 = pass_wgt * (psg['sum'] - psg['count'] * psg['min'].min()) / (psg['max'].max() - psg['min'].min())
+        col2 = dep_wgt * (dep['sum'] - dep['count'] * dep['min'].min()) / (dep['max'].max() - dep['min'].min())
+        weighted = (col1 + col2).rename('weighted')
+    with stage('sc4.groupby_airline', rows=len(weighted)):
+        df_grouped = weighted.groupby(level='airline_id', observed=True).sum().reset_index()
+        df_grouped = df_grouped.sort_values('weighted', ascending=False).nlargest(nlargest, 'weighted')
+    df_grouped['country'] = df_grouped['airline_id'].map(data.lookups['airline_countries'])
+    df_grouped['name'] = df_grouped['airline_id'].map(data.lookups['airline_names'])
+    return df_grouped
+
+
+# Scenario functions by name and the names of the DataFrames they return
+SCENARIOS = {
+    'busiest_airports': (busiest_airports, ('totals', 'by_year')),
+    'average_flights': (average_flights, ('averages',)),
+    'us_foreign_share': (us_foreign_share, ('by_year', 'totals')),
+    'traffic_correlation': (traffic_correlation, ('correlation',)),
+    'airline_traffic': (airline_traffic, ('airlines',)),
+}
+
+
+def evaluate(data: AnalysisData, scenario: str, params: dict) -> Dict[str, pd.DataFrame]:
+    '''Result DataFrames of a scenario by name'''
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario {scenario!r}, expected one of {', '.join(SCENARIOS)}")
+    func, names = SCENARIOS[scenario]
+    result = func(data, **params)
+    return dict(zip(names, result if isinstance(result, tuple) else (result,)))
+
+
+def alternatives(name, value):
+    if name == 'airline_selection':
+        # A selection is a list itself, alternatives are a list of selections
+        selections = value if value and isinstance(value[0], list) else [value]
+        return [tuple(sorted(v)) for v in selections]
+    return value if isinstance(value, list) else [value]
+
+
+def expand_grid(spec: dict) -> Iterator[dict]:
+    '''Parameter combinations of a batch entry: list values are the alternatives of a parameter'''
+    params = spec.get('params', {})
+    values = [alternatives(k, v) for k, v in params.items()]
+    for combination in itertools.product(*values):
+        yield dict(zip(params, combination))
+
+
+def run_batch(data: AnalysisData, specs: List[dict]) -> Iterator[Tuple[str, dict, Dict[str, pd.DataFrame]]]:
+    '''Evaluates all the parameter combinations of the batch entries ({'scenario': name, 'params': {...}})
+       against the same data (cubes are built once, repeated combinations come from the query cache)
+    '''
+    for spec in specs:
+        for params in expand_grid(spec):
+            yield spec['scenario'], params, evaluate(data, spec['scenario'], params)
+
+
+def labeled(df):
+    # Keep named indexes (e.g. correlation matrix rows) as columns
+    return df.reset_index() if df.index.name else df
+
+
+def to_records(result: Dict[str, pd.DataFrame]) -> dict:
+    return {name: json.loads(labeled(df).to_json(orient='records')) for name, df in result.items()}
+
+
+if __name__ == '__main__':
+    part_a_fld = Path().absolute() / 'Data' / 'Part-A'
+    parser = argparse.ArgumentParser(description='Part A business scenarios without the app')
+    parser.add_argument('--export-fld', type=Path, default=part_a_fld / 'Export', help='Folder of the exported tables')
+    parser.add_argument('--store-fld', type=Path, default=part_a_fld / 'Store', help='Folder of the parquet tables')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE, help='Query engine (DIT161_ENGINE)')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv', help='Output format of a scenario (batch output is json)')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+    sc1 = subparsers.add_parser('busiest_airports', help='Scenario 1')
+    sc1.add_argument('min_year', type=int)
+    sc1.add_argument('max_year', type=int)
+    sc1.add_argument('--nlargest', type=int, default=5)
+    sc2 = subparsers.add_parser('average_flights', help='Scenario 2')
+    sc2.add_argument('airline_id')
+    sc2.add_argument('min_year', type=int)
+    sc2.add_argument('max_year', type=int)
+    sc2.add_argument('--period-type', choices=PERIOD_TYPES, default='month')
+    sc2.add_argument('--flight-type', choices=FLIGHT_TYPES, default='total')
+    sc3 = subparsers.add_parser('us_foreign_share', help='Scenario 3')
+    sc3.add_argument('min_year', type=int)
+    sc3.add_argument('max_year', type=int)
+    subparsers.add_parser('traffic_correlation', help='Scenario 4 correlation')
+    sc4 = subparsers.add_parser('airline_traffic', help='Scenario 4')
+    sc4.add_argument('--airlines', nargs='+', choices=list(AIRLINE_GROUPS), default=list(AIRLINE_GROUPS))
+    sc4.add_argument('--pass-wgt', type=float, default=0.5)
+    sc4.add_argument('--nlargest', type=int, default=5)
+    batch = subparsers.add_parser('batch', help='Evaluate the scenario parameter combinations of a json file')
+    batch.add_argument('specs', type=Path, help='json list of {"scenario": name, "params": {name: value or list of values}}')
+    batch.add_argument('--output', type=Path, help='Output json file (default stdout)')
+    args = vars(parser.parse_args())
+
+    export_fld, store_fld, fmt, scenario = args.pop('export_fld'), args.pop('store_fld'), args.pop('format'), args.pop('scenario')
+    data = load_data(store_fld, export_fld, args.pop('engine'))
+    if scenario == 'batch':
+        specs = json.loads(args['specs'].read_text(encoding='utf-8'))
+        report = [{'scenario': name, 'params': params, 'result': to_records(result)} for name, params, result in run_batch(data, specs)]
+        output = json.dumps(report, indent=2)
+        if args['output']:
+            args['output'].write_text(output, encoding='utf-8')
+        else:
+            print(output)
+    else:
+        if scenario == 'airline_traffic':
+            args['airline_selection'] = tuple(sorted(AIRLINE_GROUPS[a] for a in args.pop('airlines')))
+        for name, df in evaluate(data, scenario, args).items():
+            if fmt == 'json':
+                print(json.dumps(to_records({name: df})))
+            else:
+                print(f"# {name}")
+                print(labeled(df).to_csv(index=False), end='')
@@ -2,8 +2,7 @@ import streamlit as st
 from streamlit_option_menu import option_menu
 
 from home import Home
-from part_a import PartA
-from part_b import PartB
+from perf import perf_panel
 
 page_title = 'DIT161-Project | Anastasios Kotronis (itp22104)'
 page_icon=':bar_chart:'
@@ -27,7 +26,7 @@ st.markdown(hide_st_style, unsafe_allow_html=True)
 with st.sidebar:
     main_selected = option_menu(
         menu_title=None,
-        options = ['Home', 'Part A'],#, 'Part B'],
+        options = ['Home', 'Part A', 'Part B'],
         # https://icons.getbootstrap.com/
         icons = ['house', '', ''],
         menu_icon=None,
@@ -39,7 +38,12 @@ if main_selected == 'Home':
     hm = Home()
     hm.load_page()
 elif main_selected == 'Part A':
-    pa = PartA()
+    # Imported and created on first visit, kept for the session (the data is loaded by the page that needs it)
+    from part_a import PartA
+    if 'part_a' not in st.session_state:
+        st.session_state['part_a'] = PartA()
+    pa = st.session_state['part_a']
+    pa.select_page()
     if pa.selected == 'Data Info':
         pa.display_info_page()
     elif pa.selected == 'A) Preparation':
@@ -48,5 +52,17 @@ elif main_selected == 'Part A':
         pa.display_analysis_page()
     
 elif main_selected == 'Part B':
-    pb = PartB()
-    data_dict = pb.load_data()
+    from part_b import PartB
+    if 'part_b' not in st.session_state:
+        st.session_state['part_b'] = PartB()
+    pb = st.session_state['part_b']
+    pb.select_page()
+    if pb.selected == 'Data Info':
+        pb.display_info_page()
+    elif pb.selected == 'Analysis':
+        pb.display_analysis_page()
+    elif pb.selected == 'Models':
+        pb.display_models_page()
+
+# Stage timings and cache stats (only with DIT161_PERF set)
+perf_panel()
@@ -0,0 +1,246 @@
+import hashlib
+import inspect
+import itertools
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from perf import stage
+
+# All caches of the process by name (for stats)
+CACHES = {}
+
+_MISSING = object()
+# Layout of the persistently cached results, part of their keys: bump when the results of the memoized
+# functions change, so the results written by older code are not read
+RESULTS_FORMAT = 1
+
+
+class LRUCache:
+    '''Thread safe LRU cache with optional time to live (seconds) for the entries.
+       One instance is shared by all sessions of the process and values are not copied,
+       so cached values must be treated as read-only
+    '''
+    def __init__(self, name, maxsize=128, ttl=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        CACHES[name] = self
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else None,
+        }
+
+
+class DiskCache:
+    '''Persistent cache of pickled values in a folder (one file per key), shared by processes.
+       Keys must have a stable repr across processes (see make_hashable persistent).
+       Inactive (always missing, no writes) unless the folder exists. Read-only unless write is set
+       (the app reads the results written by a batch job, so the folder does not grow per request)
+    '''
+    def __init__(self, name, fld, write=False):
+        self.name = name
+        self.fld = fld
+        self.write = write
+        self.hits = 0
+        self.misses = 0
+        CACHES[name] = self
+
+    @property
+    def fld(self):
+        return self._fld
+
+    @fld.setter
+    def fld(self, fld):
+        self._fld = fld
+        # Number of files, counted on first use and then kept up to date by set/clear (no folder scan per stats)
+        self._size = None
+
+    @property
+    def active(self):
+        return self.fld is not None and self.fld.is_dir()
+
+    def path(self, key):
+        return self.fld / f"{hashlib.sha1(repr(key).encode('utf-8')).hexdigest()}.pkl"
+
+    def get(self, key, default=None):
+        if not self.active:
+            return default
+        try:
+            with open(self.path(key), 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if not self.active or not self.write:
+            return
+        # Write to a temporary file and rename, so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.fld, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        path = self.path(key)
+        new = not path.exists()
+        os.replace(tmp_path, path)
+        if new and self._size is not None:
+            self._size += 1
+
+    def clear(self):
+        if self.active:
+            for path in self.fld.glob('*.pkl'):
+                path.unlink()
+            self._size = 0
+
+    def __len__(self):
+        if not self.active:
+            return 0
+        if self._size is None:
+            self._size = sum(1 for _ in self.fld.glob('*.pkl'))
+        return self._size
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self),
+            'maxsize': None,
+            'ttl': None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else None,
+        }
+
+
+class SharedData:
+    '''Base of the data shared read-only by all sessions (dataset.AnalysisData, engine.SqlData, sfo.SFOData).
+       cache_key identifies the instance and its version (bumped by in place updates) in memoized query keys,
+       persistent_key its source files and applied incremental parts across processes (None if not loaded from files)
+    '''
+    _tokens = itertools.count()
+
+    def __init__(self, source=None, parts=()):
+        self.source = source
+        self.parts = list(parts)
+        self.version = 0
+        self._token = next(SharedData._tokens)
+
+    @property
+    def cache_key(self):
+        return (type(self).__name__, self._token, self.version)
+
+    @property
+    def persistent_key(self):
+        return self.source_key(self.source, self.parts)
+
+    @classmethod
+    def source_key(cls, source, parts=()):
+        if source is None:
+            return None
+        return (cls.__name__, hashlib.sha1(repr((source, tuple(parts))).encode('utf-8')).hexdigest())
+
+
+def cache_stats():
+    return [cache.stats() for cache in CACHES.values()]
+
+
+def make_hashable(value, persistent=False):
+    '''Cache key of a value. persistent: key valid across processes (objects with a cache_key
+       provide persistent_key, None if they have none: the key is then _MISSING)
+    '''
+    if hasattr(value, 'cache_key'):
+        if not persistent:
+            return value.cache_key
+        key = getattr(value, 'persistent_key', None)
+        return _MISSING if key is None else key
+    if isinstance(value, (list, tuple)):
+        return tuple(make_hashable(v, persistent) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(make_hashable(v, persistent) for v in value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, make_hashable(v, persistent)) for k, v in value.items()))
+    return value
+
+
+def memoize(cache, disk=None):
+    '''Decorator that caches the function results in `cache`, and in the persistent `disk` cache if given
+       (looked up after `cache`, for the arguments with a persistent key).
+       As in streamlit caching, arguments starting with _ are not hashed (not part of the key),
+       so DataFrames and other shared objects should be passed as _arguments
+    '''
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (func.__qualname__,) + tuple(make_hashable(v) for k, v in bound.arguments.items() if not k.startswith('_'))
+            with stage(func.__qualname__) as info:
+                value = cache.get(key, _MISSING)
+                info['cache'] = 'miss' if value is _MISSING else 'hit'
+                if value is _MISSING:
+                    disk_key = persistent_key(bound) if disk is not None and disk.active else None
+                    if disk_key is not None:
+                        value = disk.get(disk_key, _MISSING)
+                        info['cache'] = 'miss' if value is _MISSING else 'disk'
+                    if value is _MISSING:
+                        value = func(*args, **kwargs)
+                        if disk_key is not None:
+                            disk.set(disk_key, value)
+                    cache.set(key, value)
+            return value
+
+        def persistent_key(bound):
+            key = tuple(make_hashable(v, True) for k, v in bound.arguments.items() if not k.startswith('_'))
+            return None if _MISSING in key else (RESULTS_FORMAT, func.__qualname__) + key
+
+        wrapper.cache = cache
+        wrapper.disk = disk
+        return wrapper
+    return decorator
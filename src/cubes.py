@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+DEP_COLUMNS = ['dep_scheduled_flights', 'dep_charter_flights', 'dep_total_flights']
+TRAFFIC_COLUMNS = ['psg_total_flights', 'dep_total_flights']
+
+# How the sum, count, min, max of the traffic cube combine across parts of the fact table
+TRAFFIC_MERGE = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+# Aggregates of the narrow (uint32) fact table counts are int64 (signed arithmetic in the scenarios)
+
+
+def airport_year(flights):
+    # Scenario 1: passengers per US airport and year
+    return flights.groupby(['airport_usa_id', 'year'], observed=True)[['psg_total_flights']].sum().astype('int64')
+
+
+def airline_period(flights):
+    # Scenario 2: departures per airline, year and month (season follows month)
+    return flights.groupby(['airline_id', 'year', 'month', 'season'], observed=True)[DEP_COLUMNS].sum().astype('int64')
+
+
+def year_us_foreign(flights):
+    # Scenario 3: number of flights per year and us/foreign airline
+    return flights.groupby(['year', 'us_foreign_airline']).size().rename('count')
+
+
+def airline_traffic(flights):
+    # Scenario 4: passengers/flights sum, count, min, max per us/foreign and airline
+    return flights.groupby(['us_foreign_airline', 'airline_id'], observed=True)[TRAFFIC_COLUMNS].agg(list(TRAFFIC_MERGE)).astype('int64')
+
+
+def airport_prefix(airport_year):
+    '''Scenario 1 sufficient statistics: passengers and years with flights per US airport, cumulative over
+       the years (airports x years arrays). Any year range total is two column lookups, without regrouping
+    '''
+    airport_codes, airports = pd.factorize(airport_year.index.get_level_values('airport_usa_id'), sort=True)
+    year_codes, years = pd.factorize(airport_year.index.get_level_values('year'), sort=True)
+    passengers = np.zeros((len(airports), len(years)), dtype='int64')
+    present = np.zeros((len(airports), len(years)), dtype='int64')
+    passengers[airport_codes, year_codes] = airport_year['psg_total_flights'].to_numpy()
+    present[airport_codes, year_codes] = 1
+    return {
+        'airports': airports.rename('airport_usa_id'),
+        'years': np.asarray(years),
+        'passengers': passengers.cumsum(axis=1),
+        'present': present.cumsum(axis=1),
+    }
+
+
+def prefix_window(prefix, min_year, max_year):
+    '''Columns of the airport prefix arrays giving the totals of [min_year, max_year]: (last, before first), None if no years'''
+    first = np.searchsorted(prefix['years'], min_year, 'left')
+    last = np.searchsorted(prefix['years'], max_year, 'right') - 1
+    if last < first:
+        return None
+    return last, first - 1
+
+
+def traffic_moments(flights):
+    # Scenario 4 sufficient statistics of the correlation: rows, means, sums of squared deviations and co-deviations
+    x = flights['psg_total_flights'].to_numpy(dtype='float64')
+    y = flights['dep_total_flights'].to_numpy(dtype='float64')
+    n = len(x)
+    mean_x, mean_y = (x.mean(), y.mean()) if n else (0., 0.)
+    dx, dy = x - mean_x, y - mean_y
+    return {'n': n, 'mean_x': mean_x, 'mean_y': mean_y, 'm2_x': dx @ dx, 'm2_y': dy @ dy, 'c_xy': dx @ dy}
+
+
+def merge_moments(a, b):
+    '''Moments of the union of two parts of the fact table (pairwise update, no rescans)'''
+    n = a['n'] + b['n']
+    if not a['n'] or not b['n']:
+        return dict(a if a['n'] else b)
+    delta_x, delta_y = b['mean_x'] - a['mean_x'], b['mean_y'] - a['mean_y']
+    w = a['n'] * b['n'] / n
+    return {
+        'n': n,
+        'mean_x': a['mean_x'] + delta_x * b['n'] / n,
+        'mean_y': a['mean_y'] + delta_y * b['n'] / n,
+        'm2_x': a['m2_x'] + b['m2_x'] + delta_x * delta_x * w,
+        'm2_y': a['m2_y'] + b['m2_y'] + delta_y * delta_y * w,
+        'c_xy': a['c_xy'] + b['c_xy'] + delta_x * delta_y * w,
+    }
+
+
+# Cubes with a year index level, rebuilt per year on appends
+YEAR_CUBES = {'airport_year': airport_year, 'airline_period': airline_period, 'year_us_foreign': year_us_foreign}
+
+
+def build_cubes(flights):
+    '''Materialized rollups of the enriched fact table, one per business scenario, and the sufficient
+       statistics derived from them. Scenarios filter/regroup these instead of scanning the fact table
+    '''
+    # Sorted by the index (pandas keeps the categorical groups of observed=True in order of appearance),
+    # same as the cubes updated on appends
+    cubes = {name: build(flights).sort_index() for name, build in YEAR_CUBES.items()}
+    cubes['airline_traffic'] = airline_traffic(flights).sort_index()
+    cubes['airport_prefix'] = airport_prefix(cubes['airport_year'])
+    cubes['traffic_moments'] = traffic_moments(flights)
+    return cubes
+
+
+def concat_cubes(parts, flights):
+    '''Concatenate parts of a cube, restoring the categorical index levels (with the categories of the fact table)'''
+    cube = pd.concat(parts)
+    names = list(cube.index.names)
+    if any(flights[c].dtype == 'category' for c in names):
+        is_series = isinstance(cube, pd.Series)
+        df = cube.reset_index()
+        for c in names:
+            if flights[c].dtype == 'category':
+                df[c] = df[c].astype(flights[c].dtype)
+        cube = df.set_index(names)
+        if is_series:
+            cube = cube[parts[0].name]
+    return cube.sort_index()
+
+
+def update_cubes(cubes, flights, new_flights):
+    '''Cubes of the fact table `flights` after appending `new_flights` to it, from the cubes before the append.
+       Year cubes are rebuilt only for the years of the new rows, the traffic cube merges the new statistics
+    '''
+    years = new_flights['year'].unique()
+    affected = flights[flights['year'].isin(years)]
+    updated = {}
+    for name, build in YEAR_CUBES.items():
+        cube = cubes[name]
+        kept = cube[~cube.index.get_level_values('year').isin(years)]
+        updated[name] = concat_cubes([kept, build(affected)], flights)
+
+    traffic = concat_cubes([cubes['airline_traffic'], airline_traffic(new_flights)], flights)
+    traffic = traffic.groupby(level=list(traffic.index.names), observed=True).agg({c: TRAFFIC_MERGE[c[1]] for c in traffic.columns})
+    updated['airline_traffic'] = traffic
+    updated['airport_prefix'] = airport_prefix(updated['airport_year'])
+    updated['traffic_moments'] = merge_moments(cubes['traffic_moments'], traffic_moments(new_flights))
+    return updated
+
+
+def year_slice(cube, min_year, max_year):
+    '''Rows of a cube with a year index level within [min_year, max_year]'''
+    years = cube.index.get_level_values('year')
+    return cube.loc[(years >= min_year) & (years <= max_year)]
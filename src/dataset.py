@@ -0,0 +1,169 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cache import SharedData
+from cubes import build_cubes, prefix_window, update_cubes, year_slice
+from perf import stage
+from store import SCHEMAS, apply_schema, concat_tables, delta_parts, load_table, read_delta, source_fingerprint
+
+# Columns enrich_flights adds to the fact table
+DATE_COLUMNS = ['year', 'month', 'season']
+# Dimension tables extended by the incremental appends of the fact table
+DATE_TABLES = ['dates', 'days', 'months', 'seasons']
+
+# Fact table code columns kept as dense integer codes (pandas categorical)
+CODE_COLUMNS = [c for c, dtype in SCHEMAS['flights'].items() if dtype == 'category']
+
+
+def date_lookup(dates, column, dtype):
+    '''Array indexed by date id with the values of a dates column'''
+    lookup = np.zeros(dates['id'].max() + 1, dtype=dtype)
+    lookup[dates['id'].to_numpy()] = dates[column].to_numpy()
+    return lookup
+
+
+def enrich_flights(flights, dates):
+    '''Fact table with the date attributes used by the scenarios as compact integer columns
+       (year, month 1-12, season 0-3) and the code columns as categoricals
+    '''
+    date_ids = flights['date_id'].to_numpy()
+    enriched = {
+        'year': date_lookup(dates, 'year', 'uint16')[date_ids],
+        'month': date_lookup(dates, 'month', 'uint8')[date_ids],
+        'season': date_lookup(dates, 'season_id', 'uint8')[date_ids],
+    }
+    for c in flights.columns:
+        if c in CODE_COLUMNS and flights[c].dtype != 'category':
+            enriched[c] = flights[c].astype('category')
+        else:
+            enriched[c] = flights[c]
+    return pd.DataFrame(enriched, index=flights.index)
+
+
+def used_categories(codes):
+    '''Categories of a categorical Series that appear in it (in category order)'''
+    used = np.unique(codes.cat.codes.to_numpy())
+    return codes.cat.categories[used[used >= 0]]
+
+
+def build_lookups(tables, airline_ids):
+    '''Label lookups (id -> name) built once from the dimension tables and the (sorted) airline ids of the fact table'''
+    airlines = tables['airlines'].set_index('id')
+    country_names = tables['countries'].set_index('id')['name']
+    airline_names = airlines['name']
+    return {
+        'airport_names': tables['airports'].set_index('id')['name'],
+        'airline_names': airline_names,
+        'airline_countries': airlines['country_id'].map(country_names),
+        # Options of the airline selection: "id | name" for the airlines of the fact table, sorted by id
+        'airline_labels': pd.Series(airline_ids).str.cat(airline_names.reindex(airline_ids).values, ' | '),
+        'month_names': tables['months'].set_index('id')['month'],
+        'season_names': tables['seasons'].set_index('id')['season'],
+    }
+
+
+class AnalysisData(SharedData):
+    '''Star schema tables, enriched fact table, scenario cubes and label lookups, shared read-only by all sessions.
+       New months of the fact table are applied in place with append/refresh, which bump the version
+    '''
+    def __init__(self, tables, parts=(), source=None, flights=None, cubes=None):
+        '''flights, cubes: already enriched fact table and its cubes (e.g. memory mapped, see mmap_store.py)
+           instead of tables['flights']
+        '''
+        super().__init__(source, parts)
+        if flights is None:
+            with stage('data.enrich', rows=len(tables['flights'])):
+                flights = enrich_flights(tables['flights'], tables['dates'])
+        self.flights = flights
+        # The enriched fact table has all the columns of the loaded one
+        self.tables = dict(tables, flights=self.flights)
+        self.columns = [c for c in self.flights.columns if c not in DATE_COLUMNS]
+        if cubes is None:
+            with stage('data.cubes', rows=len(self.flights)):
+                cubes = build_cubes(self.flights)
+        self.cubes = cubes
+        with stage('data.lookups', rows=len(self.flights)):
+            self.lookups = build_lookups(self.tables, used_categories(self.flights['airline_id']))
+        self._lock = threading.Lock()
+
+    # Cube slices the scenarios start from (same frames as the queries of engine.SqlData)
+
+    def airport_year(self, min_year, max_year, airports=None):
+        cube = self.cubes['airport_year']
+        if airports is not None:
+            cube = cube[cube.index.get_level_values('airport_usa_id').isin(airports)]
+        return year_slice(cube, min_year, max_year)
+
+    def airport_totals(self, min_year, max_year):
+        '''Passengers per US airport (with flights) in [min_year, max_year], from the prefix sums over the years'''
+        prefix = self.cubes['airport_prefix']
+        window = prefix_window(prefix, min_year, max_year)
+        if window is None:
+            return pd.DataFrame({'psg_total_flights': pd.Series(dtype='int64')}, index=prefix['airports'][:0])
+        last, before = window
+
+        def total(name):
+            values = prefix[name][:, last]
+            return values - prefix[name][:, before] if before >= 0 else values
+
+        present = total('present') > 0
+        return pd.DataFrame({'psg_total_flights': total('passengers')[present]}, index=prefix['airports'][present])
+
+    def airline_period(self, airline_id, min_year, max_year):
+        cube = self.cubes['airline_period']
+        try:
+            cube = cube.loc[airline_id]
+        except KeyError:
+            # Unknown airline: no rows (as the SQL engine)
+            cube = cube.iloc[:0].droplevel('airline_id')
+        return year_slice(cube, min_year, max_year)
+
+    def year_us_foreign(self, min_year, max_year):
+        return year_slice(self.cubes['year_us_foreign'], min_year, max_year)
+
+    def airline_traffic(self, airline_selection):
+        cube = self.cubes['airline_traffic']
+        # Selected values without airlines have no rows (as the SQL engine)
+        present = set(cube.index.get_level_values('us_foreign_airline'))
+        return cube.loc[[s for s in airline_selection if s in present]]
+
+    def traffic_correlation(self):
+        moments = self.cubes['traffic_moments']
+        r = moments['c_xy'] / np.sqrt(moments['m2_x'] * moments['m2_y']) if moments['n'] > 1 else np.nan
+        columns = ['psg_total_flights', 'dep_total_flights']
+        return pd.DataFrame([[1., r], [r, 1.]], index=columns, columns=columns)
+
+    def append(self, flights, date_tables, parts=(), source=None):
+        '''Append new fact table rows. date_tables: the dates dimensions extended to the dates of the new rows.
+           parts, source: the store parts of the rows and the fingerprint of the source files with them.
+           Only the cube entries of the years of the new rows are recomputed
+        '''
+        with stage('data.append', rows=len(flights)):
+            new_flights = enrich_flights(apply_schema(flights[self.columns].copy(), 'flights'), date_tables['dates'])
+            all_flights = concat_tables([self.flights, new_flights])
+            tables = dict(self.tables, **date_tables, flights=all_flights)
+            cubes = update_cubes(self.cubes, all_flights, new_flights)
+            lookups = build_lookups(tables, used_categories(all_flights['airline_id']))
+        self.flights, self.tables, self.cubes, self.lookups = all_flights, tables, cubes, lookups
+        self.parts = self.parts + list(parts)
+        # None: rows not from store parts, no longer identified by the source files
+        self.source = source if parts else None
+        self.version += 1
+
+    def refresh(self, store_fld, export_fld):
+        '''Apply the incremental parts of the store written since the data was loaded.
+           Returns True if the data changed
+        '''
+        if not [p for p in delta_parts(store_fld, 'flights') if p not in self.parts]:
+            return False
+        with self._lock:
+            parts = [p for p in delta_parts(store_fld, 'flights') if p not in self.parts]
+            if not parts:
+                return False
+            flights = read_delta(store_fld, 'flights', parts, self.columns)
+            date_tables = {name: load_table(store_fld, None, name) for name in DATE_TABLES}
+            # The appends rewrite the dates tables: same persistent key as the data loaded by a new process
+            self.append(flights, date_tables, parts, source_fingerprint(store_fld, export_fld))
+            return True
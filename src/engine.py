@@ -0,0 +1,154 @@
+import threading
+
+import pandas as pd
+
+from cache import SharedData
+from dataset import DATE_TABLES, build_lookups
+from perf import stage
+from store import EXPORT_TABLES, delta_fld, delta_parts, load_table, source_fingerprint
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Scenario columns of the fact table, the rest are not read by the scans
+FACT_COLUMNS = [
+    'date_id', 'airport_usa_id', 'airline_id', 'us_foreign_airline',
+    'psg_total_flights', 'dep_scheduled_flights', 'dep_charter_flights', 'dep_total_flights',
+]
+TRAFFIC_STATS = ['sum', 'count', 'min', 'max']
+
+
+def available(store_fld):
+    '''The SQL engine needs duckdb and all the tables in the parquet store (it does not read the zipped csv tables)'''
+    return duckdb is not None and all((store_fld / f"{name}.parquet").exists() for name in EXPORT_TABLES)
+
+
+class SqlData(SharedData):
+    '''Star schema queried in place with duckdb over the parquet store: multi-threaded vectorized scans
+       of the fact table, with the year range (as a date id range) and airline filters pushed down to
+       the parquet reader. Only the dimension tables and the query results are pandas frames.
+       Same interface as dataset.AnalysisData for the scenarios (cube slices, tables, lookups, keys)
+    '''
+    def __init__(self, store_fld, parts=(), source=None, threads=None):
+        super().__init__(source, parts)
+        self.store_fld = store_fld
+        self.tables = {name: load_table(store_fld, None, name) for name in EXPORT_TABLES if name != 'flights'}
+        self._lock = threading.Lock()
+        self._con = duckdb.connect()
+        if threads:
+            self._con.execute(f"SET threads = {int(threads)}")
+        self._create_views()
+        self.lookups = build_lookups(self.tables, self.airline_ids())
+
+    def _create_views(self):
+        files = [str(self.store_fld / 'flights.parquet')] + [str(delta_fld(self.store_fld, 'flights') / p) for p in self.parts]
+        # Views of relations: the paths are not pasted into the SQL
+        self._con.read_parquet(files).project(', '.join(FACT_COLUMNS)).create_view('fact', replace=True)
+        self._con.read_parquet(str(self.store_fld / 'dates.parquet')).create_view('dates', replace=True)
+        # Fact rows with the date attributes of the scenarios
+        self._con.execute('''
+            CREATE OR REPLACE VIEW flights AS
+            SELECT f.*, d.year, d.month, d.season_id AS season
+            FROM fact f JOIN dates d ON f.date_id = d.id
+        ''')
+
+    def query(self, sql, params=None):
+        # A cursor per query: connections are not shared between threads
+        with stage('sql.query') as info:
+            df = self._con.cursor().execute(sql, params or []).df()
+            info['rows'] = len(df)
+        return df
+
+    def airline_ids(self):
+        return pd.Index(self.query('SELECT DISTINCT airline_id FROM fact ORDER BY airline_id')['airline_id'].to_numpy())
+
+    def date_ids(self, min_year, max_year):
+        '''Date id range of the years: dates ids increase with the date, so this is a range predicate on the fact table'''
+        dates = self.tables['dates']
+        ids = dates.loc[(dates['year'] >= min_year) & (dates['year'] <= max_year), 'id']
+        return (int(ids.min()), int(ids.max())) if len(ids) else (0, -1)
+
+    @staticmethod
+    def as_cube(df, index, categorical=()):
+        for c in categorical:
+            df[c] = df[c].astype('category')
+        return df.set_index(index)
+
+    def airport_year(self, min_year, max_year, airports=None):
+        params = list(self.date_ids(min_year, max_year))
+        airport_filter = ''
+        if airports is not None:
+            airports = [str(a) for a in airports]
+            airport_filter = f"AND airport_usa_id IN ({', '.join('?' * len(airports))})" if airports else 'AND false'
+            params += airports
+        df = self.query(f'''
+            SELECT airport_usa_id, year, sum(psg_total_flights)::BIGINT AS psg_total_flights
+            FROM flights WHERE date_id BETWEEN ? AND ? {airport_filter}
+            GROUP BY ALL ORDER BY airport_usa_id, year
+        ''', params)
+        return self.as_cube(df, ['airport_usa_id', 'year'], ['airport_usa_id'])
+
+    def airport_totals(self, min_year, max_year):
+        df = self.query('''
+            SELECT airport_usa_id, sum(psg_total_flights)::BIGINT AS psg_total_flights
+            FROM fact WHERE date_id BETWEEN ? AND ?
+            GROUP BY ALL ORDER BY airport_usa_id
+        ''', self.date_ids(min_year, max_year))
+        return self.as_cube(df, ['airport_usa_id'], ['airport_usa_id'])
+
+    def airline_period(self, airline_id, min_year, max_year):
+        df = self.query('''
+            SELECT year, month, season,
+                   sum(dep_scheduled_flights)::BIGINT AS dep_scheduled_flights,
+                   sum(dep_charter_flights)::BIGINT AS dep_charter_flights,
+                   sum(dep_total_flights)::BIGINT AS dep_total_flights
+            FROM flights WHERE airline_id = ? AND date_id BETWEEN ? AND ?
+            GROUP BY ALL ORDER BY year, month, season
+        ''', [airline_id, *self.date_ids(min_year, max_year)])
+        return self.as_cube(df, ['year', 'month', 'season'])
+
+    def year_us_foreign(self, min_year, max_year):
+        df = self.query('''
+            SELECT year, us_foreign_airline, count(*) AS count
+            FROM flights WHERE date_id BETWEEN ? AND ?
+            GROUP BY ALL ORDER BY year, us_foreign_airline
+        ''', self.date_ids(min_year, max_year))
+        return self.as_cube(df, ['year', 'us_foreign_airline'])['count']
+
+    def airline_traffic(self, airline_selection):
+        selection = [int(s) for s in airline_selection]
+        aggregates = ', '.join(
+            f"{stat}({c})::BIGINT AS {c}__{stat}" if stat != 'count' else f"count({c}) AS {c}__count"
+            for c in ['psg_total_flights', 'dep_total_flights'] for stat in TRAFFIC_STATS
+        )
+        df = self.query(f'''
+            SELECT us_foreign_airline, airline_id, {aggregates}
+            FROM fact WHERE us_foreign_airline IN ({', '.join('?' * len(selection))})
+            GROUP BY ALL ORDER BY us_foreign_airline, airline_id
+        ''', selection)
+        df = self.as_cube(df, ['us_foreign_airline', 'airline_id'], ['airline_id'])
+        df.columns = pd.MultiIndex.from_tuples([tuple(c.split('__')) for c in df.columns])
+        return df
+
+    def traffic_correlation(self):
+        r = float(self.query('SELECT corr(psg_total_flights, dep_total_flights) AS r FROM fact')['r'].iloc[0])
+        columns = ['psg_total_flights', 'dep_total_flights']
+        return pd.DataFrame([[1., r], [r, 1.]], index=columns, columns=columns)
+
+    def refresh(self, store_fld, export_fld):
+        '''Query the current files of the store: the incremental parts written since the data was loaded, or the
+           rewritten fact table when the parts are merged into it (store.py deletes them). Returns True if the data changed
+        '''
+        with self._lock:
+            parts = delta_parts(store_fld, 'flights')
+            source = source_fingerprint(store_fld, export_fld)
+            if parts == self.parts and source == self.source:
+                return False
+            self.parts, self.source = parts, source
+            self.tables = dict(self.tables, **{name: load_table(store_fld, None, name) for name in DATE_TABLES})
+            self._create_views()
+            self.lookups = build_lookups(self.tables, self.airline_ids())
+            self.version += 1
+            return True
@@ -0,0 +1,252 @@
+import argparse
+import calendar
+import itertools
+import io
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from store import read_export, write_delta, write_table
+
+KEY_COLUMNS = ['data_dte', 'usg_apt', 'fg_apt', 'carrier']
+VALUE_COLUMNS = ['Scheduled', 'Charter', 'Total']
+
+FLIGHTS_COLUMNS = [
+    'date_id',
+    'airport_usa_id',
+    'airport_foreign_id',
+    'airline_id',
+    'us_foreign_airline',
+    'psg_scheduled_flights',
+    'psg_charter_flights',
+    'psg_total_flights',
+    'dep_scheduled_flights',
+    'dep_charter_flights',
+    'dep_total_flights',
+]
+
+
+def read_chunks(path, columns, chunksize):
+    return pd.read_csv(
+        path,
+        usecols=columns,
+        dtype={c: str for c in KEY_COLUMNS},
+        chunksize=chunksize,
+        keep_default_na=False,
+        na_values='',
+        encoding='utf-8',
+    )
+
+
+def parse_dates(values):
+    return pd.to_datetime(values, format='%m/%d/%Y')
+
+
+def date_range(path, chunksize):
+    '''Min and max date of a raw dataset (reads only the date column)'''
+    _min, _max = None, None
+    for chunk in read_chunks(path, ['data_dte'], chunksize):
+        dates = parse_dates(chunk['data_dte'].unique())
+        _min = dates.min() if _min is None else min(_min, dates.min())
+        _max = dates.max() if _max is None else max(_max, dates.max())
+    return _min, _max
+
+
+def build_dates(_min, _max):
+    '''Dates dimension (one row per day in [_min, _max]) and the days, months, seasons tables'''
+    calendar.setfirstweekday(calendar.MONDAY)
+    date_values = pd.Series(pd.date_range(_min, _max))
+    dates = pd.DataFrame({
+        'id': date_values.index,
+        'day': date_values.dt.day,
+        'month': date_values.dt.month,
+        'year': date_values.dt.year,
+        'day_of_week_id': date_values.dt.weekday,
+        'season_id': date_values.dt.month % 12 // 3,
+        'day_of_year': date_values.dt.dayofyear,
+        'week_of_year': date_values.dt.strftime('%W').astype(int), # Monday as the first day of the week
+    })
+    days = pd.DataFrame({'id': range(7), 'weekday': list(calendar.day_name)})
+    months = pd.DataFrame({'id': range(1, 13), 'month': [m for m in calendar.month_name if m.strip()]})
+    seasons = pd.DataFrame({'id': range(4), 'season': ['Winter', 'Spring', 'Summer', 'Autumn']})
+    return {'dates': dates, 'days': days, 'months': months, 'seasons': seasons}
+
+
+class KeyEncoder:
+    '''Packs the composite key (date, usa airport, foreign airport, carrier) of the raw datasets
+       in one int64 from the date id and the positions of the codes in the dimension tables.
+       Keys of rows with codes missing from the dimensions are -1
+    '''
+    def __init__(self, min_date, airports, airlines):
+        self.min_date = min_date
+        self.airports = pd.Index(airports['id'])
+        self.airlines = pd.Index(airlines['id'])
+        self.airport_bits = len(self.airports).bit_length()
+        self.airline_bits = len(self.airlines).bit_length()
+        if 2 * self.airport_bits + self.airline_bits > 47:
+            raise ValueError('Dimension tables too large to pack the flight keys in int64')
+
+    def date_ids(self, values):
+        # Parse each distinct date string once
+        unique = pd.Series(values.unique())
+        ids = (parse_dates(unique) - self.min_date).dt.days
+        return values.map(pd.Series(ids.to_numpy(), index=unique)).to_numpy(dtype='int64')
+
+    def encode(self, chunk):
+        date_id = self.date_ids(chunk['data_dte'])
+        usa = self.airports.get_indexer(chunk['usg_apt']).astype('int64')
+        foreign = self.airports.get_indexer(chunk['fg_apt']).astype('int64')
+        airline = self.airlines.get_indexer(chunk['carrier']).astype('int64')
+        keys = (((date_id << self.airport_bits | usa) << self.airport_bits | foreign) << self.airline_bits) | airline
+        keys[(usa < 0) | (foreign < 0) | (airline < 0)] = -1
+        return keys
+
+    def decode(self, keys):
+        airline = keys & ((1 << self.airline_bits) - 1)
+        keys = keys >> self.airline_bits
+        foreign = keys & ((1 << self.airport_bits) - 1)
+        keys = keys >> self.airport_bits
+        usa = keys & ((1 << self.airport_bits) - 1)
+        date_id = keys >> self.airport_bits
+        return {
+            'date_id': date_id,
+            'airport_usa_id': self.airports[usa],
+            'airport_foreign_id': self.airports[foreign],
+            'airline_id': self.airlines[airline],
+        }
+
+
+def load_departures(path, encoder, chunksize):
+    '''Departures flights counts indexed by the packed key, kept as compact numeric arrays'''
+    keys, values = [], []
+    for chunk in read_chunks(path, KEY_COLUMNS + VALUE_COLUMNS, chunksize):
+        chunk_keys = encoder.encode(chunk)
+        mask = chunk_keys >= 0
+        keys.append(chunk_keys[mask])
+        values.append(chunk.loc[mask, VALUE_COLUMNS].to_numpy(dtype='int32'))
+    departures = pd.DataFrame(
+        np.concatenate(values),
+        index=pd.Index(np.concatenate(keys)),
+        columns=['dep_scheduled_flights', 'dep_charter_flights', 'dep_total_flights'],
+    )
+    if not departures.index.is_unique:
+        raise ValueError('Departures dataset has duplicate (date, usa airport, foreign airport, carrier) entries')
+    return departures
+
+
+def join_flights(path, departures, encoder, chunksize):
+    '''Yields the flights fact table in chunks: passengers inner joined with departures on the packed key'''
+    for chunk in read_chunks(path, KEY_COLUMNS + ['carriergroup'] + VALUE_COLUMNS, chunksize):
+        keys = encoder.encode(chunk)
+        positions = departures.index.get_indexer(keys)
+        mask = (keys >= 0) & (positions >= 0)
+        flights = pd.DataFrame(encoder.decode(keys[mask]))
+        flights['us_foreign_airline'] = chunk.loc[mask, 'carriergroup'].to_numpy()
+        flights['psg_scheduled_flights'] = chunk.loc[mask, 'Scheduled'].to_numpy()
+        flights['psg_charter_flights'] = chunk.loc[mask, 'Charter'].to_numpy()
+        flights['psg_total_flights'] = chunk.loc[mask, 'Total'].to_numpy()
+        dep = departures.iloc[positions[mask]]
+        for c in dep.columns:
+            flights[c] = dep[c].to_numpy()
+        yield flights[FLIGHTS_COLUMNS]
+
+
+def export_file(df, export_fld, filename):
+    compression_dict = dict(method='zip', archive_name=f"{filename}.csv")
+    df.to_csv(export_fld / f"{filename}.zip", index=False, compression=compression_dict)
+
+
+def export_chunks(chunks, path, archive_name):
+    '''Writes chunks of a table to a zipped csv as they come. Returns the number of rows written'''
+    rows = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open(archive_name, 'w', force_zip64=True) as f, io.TextIOWrapper(f, encoding='utf-8', newline='') as txt:
+            for chunk in chunks:
+                chunk.to_csv(txt, index=False, header=rows == 0)
+                rows += len(chunk)
+    return rows
+
+
+def run(import_fld, export_fld, chunksize=250_000):
+    '''Regenerate the flights fact table and the dates dimensions of the export folder from the raw
+       passengers and departures datasets. The airlines, airports and countries dimensions of the
+       export folder are used to resolve (and filter) the airline and airport codes
+    '''
+    passengers_path = import_fld / 'International_Report_Passengers.zip'
+    departures_path = import_fld / 'International_Report_Departures.zip'
+    airports = read_export(export_fld, 'airports', ['id'])
+    airlines = read_export(export_fld, 'airlines', ['id'])
+
+    _min, _max = date_range(passengers_path, chunksize)
+    for name, df in build_dates(_min, _max).items():
+        export_file(df, export_fld, name)
+
+    encoder = KeyEncoder(_min, airports, airlines)
+    departures = load_departures(departures_path, encoder, chunksize)
+    print(f"departures: {len(departures)} entries")
+    rows = export_chunks(join_flights(passengers_path, departures, encoder, chunksize), export_fld / 'flights.zip', 'flights.csv')
+    print(f"flights: {rows} entries -> {export_fld / 'flights.zip'}")
+
+
+def exported_date_range(export_fld):
+    dates = read_export(export_fld, 'dates', ['id', 'year', 'month', 'day']).sort_values('id')
+    values = pd.to_datetime(dates[['year', 'month', 'day']])
+    return values.iloc[0], values.iloc[-1]
+
+
+def append(passengers_path, departures_path, export_fld, store_fld, chunksize=250_000):
+    '''Append new months of the raw passengers and departures datasets to the flights fact table and
+       extend the dates dimensions. The new rows must be later than the exported dates (date ids do not change).
+       If the tables are converted to the store, the new rows are also written as an incremental part of it,
+       picked up by the running app without a full reload
+    '''
+    airports = read_export(export_fld, 'airports', ['id'])
+    airlines = read_export(export_fld, 'airlines', ['id'])
+    first, last = exported_date_range(export_fld)
+    _min, _max = date_range(passengers_path, chunksize)
+    if _min <= last:
+        raise ValueError(f"New data starts at {_min:%Y-%m-%d}, not after the exported dates ({last:%Y-%m-%d})")
+
+    encoder = KeyEncoder(first, airports, airlines)
+    departures = load_departures(departures_path, encoder, chunksize)
+    new_flights = pd.concat(join_flights(passengers_path, departures, encoder, chunksize), ignore_index=True)
+
+    # Rewrite the zipped fact table with the new rows at the end and swap it in when complete
+    tmp_path = export_fld / 'flights.zip.tmp'
+    rows = export_chunks(itertools.chain(read_export(export_fld, 'flights', chunksize=chunksize), [new_flights]), tmp_path, 'flights.csv')
+    date_tables = build_dates(first, _max)
+    for name, df in date_tables.items():
+        export_file(df, export_fld, name)
+    os.replace(tmp_path, export_fld / 'flights.zip')
+    print(f"flights: {len(new_flights)} new entries ({rows} total) -> {export_fld / 'flights.zip'}")
+
+    if (store_fld / 'flights.parquet').exists():
+        # Dimensions first: the app applies a part when it appears
+        for name, df in date_tables.items():
+            write_table(store_fld, name, df)
+        part = f"{_min:%Y%m%d}_{_max:%Y%m%d}"
+        write_delta(store_fld, 'flights', new_flights, part)
+        print(f"flights: part {part} -> {store_fld}")
+
+
+if __name__ == '__main__':
+    part_a_fld = Path().absolute() / 'Data' / 'Part-A'
+    import_fld = part_a_fld / 'Import' / '01. U.S. International Air Traffic data(1990-2020)'
+    parser = argparse.ArgumentParser(description='Regenerate the Part A fact table and dates dimensions from the raw datasets')
+    parser.add_argument('--export-fld', type=Path, default=part_a_fld / 'Export', help='Folder of the exported tables')
+    parser.add_argument('--chunksize', type=int, default=250_000, help='Rows read at a time from the raw datasets')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='Full regeneration (default)')
+    run_parser.add_argument('--import-fld', type=Path, default=import_fld, help='Folder with the raw passengers and departures datasets')
+    append_parser = subparsers.add_parser('append', help='Append new months of the raw datasets')
+    append_parser.add_argument('passengers', type=Path, help='Raw passengers dataset with the new months')
+    append_parser.add_argument('departures', type=Path, help='Raw departures dataset with the new months')
+    append_parser.add_argument('--store-fld', type=Path, default=part_a_fld / 'Store', help='Folder of the parquet tables (updated if converted)')
+    args = parser.parse_args()
+    if args.command == 'append':
+        append(args.passengers, args.departures, args.export_fld, args.store_fld, args.chunksize)
+    else:
+        run(getattr(args, 'import_fld', import_fld), args.export_fld, args.chunksize)
@@ -0,0 +1,47 @@
+from perf import stage
+
+# Template layout attributes of subplot types (sent only for figures with such subplots)
+SUBPLOT_KEYS = ['geo', 'mapbox', 'polar', 'scene', 'ternary']
+
+
+def compact_template(figure):
+    '''Figure dict with the template reduced to what the figure uses: the trace defaults of its trace
+       types and the layout defaults of its subplots (the full template is most of a small figure's json).
+       The chart renders the same
+    '''
+    layout = figure.get('layout', {})
+    template = layout.get('template')
+    if not template:
+        return figure
+    trace_types = {trace.get('type', 'scatter') for trace in figure['data']}
+    template_layout = {
+        k: v for k, v in template.get('layout', {}).items()
+        if not (k in SUBPLOT_KEYS and not any(key.startswith(k) for key in layout))
+    }
+    # Default colorscales only apply to color axes without their own (px sets them)
+    coloraxes = [v for k, v in layout.items() if k.startswith('coloraxis')]
+    if all('colorscale' in c for c in coloraxes):
+        template_layout.pop('colorscale', None)
+    template = {
+        'data': {k: v for k, v in template.get('data', {}).items() if k in trace_types},
+        'layout': template_layout,
+    }
+    return dict(figure, layout=dict(layout, template=template))
+
+
+def compact_figure(fig):
+    '''Plotly figure with its template compacted, to cache instead of the figure (it is serialized per
+       rerun by st.plotly_chart, with the full template that is most of a small figure's json)
+    '''
+    import plotly.graph_objects as go
+
+    with stage('figures.compact', rows=len(fig.data)):
+        return go.Figure(compact_template(fig.to_dict()))
+
+
+def plotly_chart(figure, container=None, use_container_width=False):
+    '''st.plotly_chart of a cached figure from compact_figure. No streamlit theme, as the figures built by plotly express'''
+    import streamlit as st
+
+    with stage('figures.plotly_chart', rows=len(figure.data)):
+        return (container or st).plotly_chart(figure, use_container_width=use_container_width, theme=None)
@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from dataset import AnalysisData
+
+# Layout version of the mapped folders (and their saved cubes), part of the folder names
+FORMAT = 2
+
+
+def write_columns(fld, flights, location=None):
+    '''Decoded fact table columns as .npy files (categoricals as their codes) and meta.json
+       with the column order, the categories, the number of rows and the location of the source tables
+    '''
+    meta = {'format': FORMAT, 'location': location, 'rows': len(flights), 'columns': [], 'categories': {}}
+    for c in flights.columns:
+        values = flights[c]
+        if values.dtype == 'category':
+            meta['categories'][c] = values.cat.categories.tolist()
+            values = values.cat.codes
+        np.save(fld / f"{c}.npy", np.ascontiguousarray(values.to_numpy()))
+        meta['columns'].append(c)
+    (fld / 'meta.json').write_text(json.dumps(meta), encoding='utf-8')
+
+
+def read_columns(fld):
+    '''Fact table of a mapped folder, each column a read-only view of its memory mapped file (no copies)'''
+    meta = json.loads((fld / 'meta.json').read_text(encoding='utf-8'))
+    columns = {}
+    for c in meta['columns']:
+        values = np.load(fld / f"{c}.npy", mmap_mode='r')
+        if c in meta['categories']:
+            # Codes are saved with the dtype pandas uses for the categories, so from_codes keeps them as they are
+            values = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(meta['categories'][c]))
+        columns[c] = values
+    # copy=False: one block per column on the mapped arrays, instead of consolidated copies
+    return pd.DataFrame(columns, copy=False)
+
+
+def mapped_fld(mmap_fld, data_key):
+    return mmap_fld / f"{data_key[1]}_v{FORMAT}"
+
+
+def source_location(store_fld, export_fld):
+    '''Folders the data is read from, saved with its columns (a mapped folder can hold the data of several stores)'''
+    return [str(store_fld.absolute()), str(export_fld.absolute())]
+
+
+def saved_location(fld):
+    try:
+        return json.loads((fld / 'meta.json').read_text(encoding='utf-8')).get('location')
+    except (OSError, ValueError):
+        return None
+
+
+def save(mmap_fld, data, location):
+    '''Write the fact table and the cubes of the analysis data to its mapped folder (skipped if it exists).
+       Written to a temporary folder and renamed, so other processes never map partial files.
+       Folders of older data of the same location (see source_location) are removed, processes
+       mapping them keep their files open
+    '''
+    fld = mapped_fld(mmap_fld, data.persistent_key)
+    if fld.exists():
+        return fld
+    mmap_fld.mkdir(parents=True, exist_ok=True)
+    tmp_fld = Path(tempfile.mkdtemp(dir=mmap_fld, prefix='.tmp_'))
+    write_columns(tmp_fld, data.flights, location)
+    with open(tmp_fld / 'cubes.pkl', 'wb') as f:
+        pickle.dump(data.cubes, f, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        os.rename(tmp_fld, fld)
+    except OSError:
+        # Written by another process meanwhile
+        shutil.rmtree(tmp_fld, ignore_errors=True)
+    for other in mmap_fld.iterdir():
+        if other.is_dir() and other != fld and not other.name.startswith('.tmp_') and saved_location(other) == location:
+            shutil.rmtree(other, ignore_errors=True)
+    return fld
+
+
+def load(mmap_fld, tables, parts, source):
+    '''Analysis data on the mapped fact table and the saved cubes of the source files, None if not saved yet'''
+    data_key = AnalysisData.source_key(source, parts)
+    fld = mapped_fld(mmap_fld, data_key) if data_key else None
+    if fld is None or not (fld / 'meta.json').exists():
+        return None
+    flights = read_columns(fld)
+    with open(fld / 'cubes.pkl', 'rb') as f:
+        cubes = pickle.load(f)
+    return AnalysisData(tables, parts, source, flights=flights, cubes=cubes)
+
+
+if __name__ == '__main__':
+    from analytics import MMAP_FLD, load_data
+
+    part_a_fld = Path().absolute() / 'Data' / 'Part-A'
+    parser = argparse.ArgumentParser(description='Save the decoded Part A fact table as memory mapped columns shared by the app processes')
+    parser.add_argument('--export-fld', type=Path, default=part_a_fld / 'Export', help='Folder of the exported tables')
+    parser.add_argument('--store-fld', type=Path, default=part_a_fld / 'Store', help='Folder of the parquet tables')
+    parser.add_argument('--mmap-fld', type=Path, default=MMAP_FLD, help='Folder of the mapped columns (DIT161_MMAP for the app)')
+    args = parser.parse_args()
+    data = load_data(args.store_fld, args.export_fld, 'pandas', mmap_fld=None)
+    fld = save(args.mmap_fld, data, source_location(args.store_fld, args.export_fld))
+    print(f"flights: {len(data.flights)} rows -> {fld}")
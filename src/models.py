@@ -0,0 +1,255 @@
+import argparse
+import hashlib
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cache import DiskCache, LRUCache
+from perf import stage
+
+# Fitted pipelines and cv results of the grid searches, persisted across runs and processes.
+# Inactive unless the folder exists, written by the command line (the app only reads it)
+MODELS_FLD = Path(os.environ.get('DIT161_MODELS', Path().absolute() / 'Data' / 'Part-B' / 'Models'))
+MODEL_CACHE = DiskCache('part_b_models', MODELS_FLD)
+# Searches loaded in this process
+FITTED_CACHE = LRUCache('part_b_fitted', maxsize=16)
+
+TASKS = ['clf', 'rgr']
+# Classification: passenger count classes
+CLASS_BINS = [0, 3_500, 7_000, 11_500, 30_000, 700_000]
+CLASS_LABELS = ['E', 'D', 'C', 'B', 'A']
+# Regression: the target is fitted as count ** TARGET_POWER (less skewed), predictions are transformed back
+TARGET_POWER = 1 / 8
+# Search metric per task
+METRICS = {'clf': 'accuracy', 'rgr': 'r2'}
+
+
+def estimators(task):
+    '''Unfitted models of a task by name'''
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+    from sklearn.linear_model import LinearRegression, RANSACRegressor
+    from sklearn.naive_bayes import GaussianNB
+    from sklearn.svm import SVC, SVR
+    from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
+
+    if task == 'clf':
+        return {
+            'dtree': DecisionTreeClassifier(random_state=1),
+            'randfor': RandomForestClassifier(random_state=1),
+            'naiveb': GaussianNB(),
+            'svm': SVC(probability=True, random_state=1),
+        }
+    return {
+        'lin': LinearRegression(),
+        'ransac': RANSACRegressor(random_state=1),
+        'dtree': DecisionTreeRegressor(random_state=1),
+        'randf': RandomForestRegressor(random_state=1),
+        'svr': SVR(epsilon=0.2),
+    }
+
+
+def alpha_range(start, stop):
+    # ccp_alpha values of the notebook grids (rounded, so the cache keys are stable)
+    return [round(a, 6) for a in np.arange(start, stop, start)]
+
+
+# Hyperparameter grids of the notebook (parameters of the model step of the pipeline)
+PARAM_GRIDS = {
+    'clf': {
+        'dtree': {'model__max_depth': list(range(2, 101, 5)), 'model__criterion': ['gini', 'entropy'], 'model__ccp_alpha': alpha_range(0.0001, 0.001)},
+        'randfor': {'model__max_depth': list(range(2, 101, 5)), 'model__ccp_alpha': alpha_range(0.0001, 0.001)},
+        'naiveb': {'model__var_smoothing': [float(v) for v in np.logspace(0, -9, num=100)]},
+        'svm': {'model__C': [0.01, 0.1], 'model__gamma': [1, 0.75]},
+    },
+    'rgr': {
+        'lin': {},
+        'ransac': {},
+        'dtree': {'model__max_depth': list(range(2, 30, 3)), 'model__min_samples_leaf': list(range(5, 18, 2)), 'model__ccp_alpha': alpha_range(0.00001, 0.0001)},
+        'randf': {'model__max_depth': list(range(25, 41, 5)), 'model__min_samples_leaf': list(range(4, 15, 2)), 'model__ccp_alpha': alpha_range(0.0001, 0.001)},
+        'svr': {'model__C': [0.01, 0.1, 0.5, 1, 10, 100], 'model__gamma': [1, 0.75]},
+    },
+}
+
+
+def prepare_data(df, task='clf', month_to_trig=False, drop_columns=()):
+    '''Predictors and target of the passengers table (sfo.py) for classification (clf) or regression (rgr).
+       Year and Activity Period are dropped (predictions for future months), month is kept
+       (as sin/cos if month_to_trig)
+    '''
+    df = df.drop(columns=['Activity Period', 'Year', *drop_columns], errors='ignore')
+    if month_to_trig and 'Month' in df.columns:
+        month = df.pop('Month').astype(float)
+        df.insert(0, 'Month_sin', np.sin(2 * np.pi * month / 12.))
+        df.insert(0, 'Month_cos', np.cos(2 * np.pi * month / 12.))
+    predictors = df.drop(columns='Passenger Count')
+    if task == 'clf':
+        target = pd.cut(df['Passenger Count'], bins=CLASS_BINS, labels=CLASS_LABELS).astype(str)
+    else:
+        target = df['Passenger Count'].astype(float) ** TARGET_POWER
+    return predictors, target
+
+
+def feature_types(predictors):
+    '''(numeric, categorical) features: floats are scaled, the rest (categories, integer codes) one hot encoded'''
+    numeric = [c for c in predictors.columns if pd.api.types.is_float_dtype(predictors[c])]
+    return numeric, [c for c in predictors.columns if c not in numeric]
+
+
+def data_pipeline(model=None, numeric_features=None, categorical_features=None):
+    '''Pipeline scaling the numeric features and one hot encoding the categorical ones, then the model'''
+    from sklearn.compose import ColumnTransformer
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('num', Pipeline(steps=[('scaler', StandardScaler())]), numeric_features),
+            ('cat', OneHotEncoder(handle_unknown='ignore'), categorical_features),
+        ],
+        remainder='passthrough',
+        # Dense output (sparse does not work with naive bayes)
+        sparse_threshold=0,
+    )
+    steps = [('preprocessor', preprocessor)]
+    if model is not None:
+        steps.append(('model', model))
+    return Pipeline(steps=steps)
+
+
+def train_test(predictors, target, task='clf', test_size=0.10, random_state=1):
+    '''Train/test split of the notebook (stratified for classification)'''
+    from sklearn.model_selection import train_test_split
+
+    stratify = target if task == 'clf' else None
+    return train_test_split(predictors, target, test_size=test_size, stratify=stratify, random_state=random_state)
+
+
+def data_hash(predictors, target):
+    '''Content hash of the training data (values, dtypes and column names)'''
+    h = hashlib.sha1()
+    h.update(repr([(c, str(predictors[c].dtype)) for c in predictors.columns]).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(predictors, index=False).to_numpy().tobytes())
+    h.update(pd.util.hash_pandas_object(target, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def fine_tune(ppl, param_grid, metric, X_train, y_train, n_splits=5, task='clf', n_jobs=-1):
+    '''Grid search with cross validation (stratified folds for classification), the candidate fits run
+       on a pool of n_jobs processes (-1: all cores)
+    '''
+    from sklearn.model_selection import GridSearchCV, StratifiedKFold
+
+    splits = StratifiedKFold(n_splits=n_splits) if task == 'clf' else n_splits
+    grid = GridSearchCV(ppl, param_grid, cv=splits, n_jobs=n_jobs, scoring=metric, return_train_score=True)
+    grid.fit(X_train, y_train)
+    return grid
+
+
+def search_key(task, name, train_hash, param_grid, metric, n_splits):
+    import sklearn
+
+    grid = tuple(sorted((k, tuple(v)) for k, v in param_grid.items()))
+    return ('search', task, name, train_hash, grid, metric, n_splits, sklearn.__version__)
+
+
+def search(task, name, X_train, y_train, param_grid=None, metric=None, n_splits=5, n_jobs=-1, fit=True, train_hash=None):
+    '''Best pipeline of a model by grid search, cached (in memory and in MODELS_FLD) by the training data hash,
+       the grid, the metric and the folds. Returns a dict with the fitted pipeline, the best parameters and
+       cv score and the cv results, None if not cached and not fit.
+       train_hash: data_hash of the training data, if already known
+    '''
+    param_grid = PARAM_GRIDS[task][name] if param_grid is None else param_grid
+    metric = metric or METRICS[task]
+    key = search_key(task, name, train_hash or data_hash(X_train, y_train), param_grid, metric, n_splits)
+    with stage('models.search') as info:
+        result = FITTED_CACHE.get(key)
+        info['cache'] = 'hit'
+        if result is None:
+            result = MODEL_CACHE.get(key)
+            info['cache'] = 'disk'
+        if result is None:
+            info['cache'] = 'miss'
+            if not fit:
+                return None
+            start = time.perf_counter()
+            numeric, categorical = feature_types(X_train)
+            grid = fine_tune(data_pipeline(estimators(task)[name], numeric, categorical), param_grid, metric, X_train, y_train, n_splits, task, n_jobs)
+            result = {
+                'key': hashlib.sha1(repr(key).encode('utf-8')).hexdigest(),
+                'task': task,
+                'name': name,
+                'pipeline': grid.best_estimator_,
+                'best_params': grid.best_params_,
+                'best_score': grid.best_score_,
+                'metric': metric,
+                'cv_results': pd.DataFrame(grid.cv_results_),
+                'seconds': time.perf_counter() - start,
+            }
+            MODEL_CACHE.set(key, result)
+        FITTED_CACHE.set(key, result)
+    return result
+
+
+def predict(result, predictors):
+    '''Predictions of a search result (regression targets transformed back to passenger counts)'''
+    y_pred = result['pipeline'].predict(predictors)
+    if result['task'] == 'rgr':
+        return np.clip(y_pred, 0, None) ** (1 / TARGET_POWER)
+    return y_pred
+
+
+def perf_on_input(ppl, X_test, y_test, task='clf'):
+    '''Performance metrics of a fitted pipeline on a data set'''
+    import sklearn.metrics as metrics
+
+    y_pred = ppl.predict(X_test)
+    if task == 'rgr':
+        mse = metrics.mean_squared_error(y_test, y_pred)
+        return {
+            'explained_variance': metrics.explained_variance_score(y_test, y_pred),
+            'r2': metrics.r2_score(y_test, y_pred),
+            'mae': metrics.mean_absolute_error(y_test, y_pred),
+            'mse': mse,
+            'rmse': np.sqrt(mse),
+        }
+    scores = {
+        'accuracy': metrics.accuracy_score(y_test, y_pred),
+        'precision_macro': metrics.precision_score(y_test, y_pred, average='macro', zero_division=0),
+        'recall_macro': metrics.recall_score(y_test, y_pred, average='macro', zero_division=0),
+        'f1_macro': metrics.f1_score(y_test, y_pred, average='macro', zero_division=0),
+    }
+    if hasattr(ppl, 'predict_proba'):
+        probs = ppl.predict_proba(X_test)
+        scores['roc_auc_macro'] = metrics.roc_auc_score(y_test, probs, multi_class='ovr', average='macro', labels=ppl.classes_)
+        scores['roc_auc_weighted'] = metrics.roc_auc_score(y_test, probs, multi_class='ovr', average='weighted', labels=ppl.classes_)
+    return scores
+
+
+if __name__ == '__main__':
+    from sfo import load_data
+
+    part_b_fld = Path().absolute() / 'Data' / 'Part-B'
+    parser = argparse.ArgumentParser(description='Grid search the Part B models and persist the fitted pipelines for the app')
+    parser.add_argument('--task', choices=TASKS, nargs='+', default=TASKS, help='clf: passenger count classes, rgr: passenger counts')
+    parser.add_argument('--models', nargs='+', help='Models of the tasks (default all, see PARAM_GRIDS; randfor/randf/svm/svr are slow)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='Processes per grid search (-1: all cores)')
+    parser.add_argument('--data-fld', type=Path, default=part_b_fld, help='Folder of the Part B archives')
+    parser.add_argument('--models-fld', type=Path, default=MODELS_FLD, help='Folder of the fitted models (DIT161_MODELS for the app)')
+    args = parser.parse_args()
+
+    args.models_fld.mkdir(parents=True, exist_ok=True)
+    MODEL_CACHE.fld = args.models_fld
+    MODEL_CACHE.write = True
+    passengers = load_data(args.data_fld, args.data_fld / 'Store').tables['passengers']
+    for task in args.task:
+        X_train, X_test, y_train, y_test = train_test(*prepare_data(passengers, task), task)
+        for name in args.models or PARAM_GRIDS[task]:
+            if name not in PARAM_GRIDS[task]:
+                continue
+            result = search(task, name, X_train, y_train, n_jobs=args.n_jobs)
+            test = perf_on_input(result['pipeline'], X_test, y_test, task)
+            print(f"{task}/{name}: cv {result['metric']} {result['best_score']:.4f}, test {result['metric']} {test[result['metric']]:.4f}, "
+                  f"{result['seconds']:.0f}s, {result['best_params']}")
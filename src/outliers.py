@@ -0,0 +1,252 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache, memoize
+from perf import stage
+
+# Fitted detectors and the outlier flags of the monthly traffic, keyed by the data and the detector configuration
+OUTLIER_CACHE = LRUCache('part_b_outliers', maxsize=64, ttl=60 * 60)
+
+# Detectors of the notebook (univariate, on the passenger counts) and their default parameters.
+# iqr and zscore are fitted in one pass over chunks (mergeable statistics), the others on the values in memory
+DETECTORS = {
+    # Outside [Q1 - k * IQR, Q3 + k * IQR], quantiles from a histogram of `bins` bins of value ** power
+    'iqr': {'k': 1.5, 'bins': 2 ** 16, 'power': 1 / 8},
+    # |zscore| of value ** power above threshold (the transformed counts are close to normal)
+    'zscore': {'threshold': 3., 'power': 1 / 8},
+    # DBSCAN noise, eps and min_samples of the notebook (sklearn default). eps None: estimated as the knee of
+    # the sorted min_samples-th neighbor distances of sample_size values, up to their knee_quantile
+    # (the largest distances would move the knee)
+    'dbscan': {'eps': 150., 'min_samples': 5, 'sample_size': 5_000, 'knee_quantile': 0.995, 'random_state': 1},
+    'isoforest': {'max_samples': 100, 'random_state': 1},
+    # Fitted on sample_size values if not None (the flags of the fitted values are then scores as new records)
+    'lof': {'n_neighbors': 20, 'contamination': 0.01, 'sample_size': None, 'random_state': 1},
+}
+# Values per batch when scoring
+BATCH_SIZE = 100_000
+# Upper bound of the histogram (passenger counts are uint32)
+HIST_MAX = 2. ** 32
+
+
+def detector_params(method, params=None):
+    '''Default parameters of a detector updated with params'''
+    if method not in DETECTORS:
+        raise ValueError(f"Unknown outlier detector {method!r}, one of {list(DETECTORS)}")
+    unknown = set(params or {}) - set(DETECTORS[method])
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)} of outlier detector {method!r}")
+    return dict(DETECTORS[method], **(params or {}))
+
+
+def chunks(values, size=BATCH_SIZE):
+    '''Float chunks of an array (or of an iterable of chunks, as is)'''
+    if isinstance(values, (np.ndarray, pd.Series, pd.Index)):
+        values = np.asarray(values, dtype=float)
+        return (values[i:i + size] for i in range(0, len(values), size))
+    return (np.asarray(chunk, dtype=float) for chunk in values)
+
+
+def histogram(chunk, bins, power):
+    '''Counts of the (nonnegative) values in bins of equal width of value ** power over [0, HIST_MAX].
+       Histograms of chunks add up to the histogram of their union
+    '''
+    return np.bincount(np.minimum((chunk ** power / HIST_MAX ** power * bins).astype(np.int64), bins - 1), minlength=bins)
+
+
+def histogram_quantiles(counts, qs, power):
+    '''Approximate quantiles of a histogram (linear within bins)'''
+    bins = len(counts)
+    cum = np.cumsum(counts)
+    # Same position as the linear interpolation of pandas quantile
+    positions = np.asarray(qs) * (cum[-1] - 1) + 0.5
+    idx = np.searchsorted(cum, positions, side='right')
+    before = np.where(idx > 0, cum[np.maximum(idx - 1, 0)], 0)
+    fraction = (positions - before) / np.maximum(counts[idx], 1)
+    return ((idx + fraction) / bins * HIST_MAX ** power) ** (1 / power)
+
+
+def moments(chunk):
+    n = len(chunk)
+    mean = float(chunk.mean()) if n else 0.
+    return {'n': n, 'mean': mean, 'm2': float(((chunk - mean) ** 2).sum())}
+
+
+def merge_moments(a, b):
+    '''Moments of the union of two chunks (pairwise update as cubes.merge_moments)'''
+    n = a['n'] + b['n']
+    if not a['n'] or not b['n']:
+        return dict(a if a['n'] else b)
+    delta = b['mean'] - a['mean']
+    return {'n': n, 'mean': a['mean'] + delta * b['n'] / n, 'm2': a['m2'] + b['m2'] + delta * delta * a['n'] * b['n'] / n}
+
+
+def kth_distances(values, k, sample_size=None, random_state=1):
+    '''Distances of (a sample of) the values to their k-th nearest neighbor among all values (self included
+       as in NearestNeighbors(k).kneighbors). Exact for 1D values by a window over the sorted values: O(n log n)
+    '''
+    s = np.sort(values)
+    n = len(s)
+    k = min(k, n)
+    idx = np.arange(n)
+    if sample_size is not None and sample_size < n:
+        idx = np.sort(np.random.default_rng(random_state).choice(n, sample_size, replace=False))
+    # The k nearest values (self included) of s[i] are s[i - k + 1 + j : i + 1 + j] for one j in [0, k)
+    best = np.full(len(idx), np.inf)
+    for j in range(k):
+        lo, hi = idx - k + 1 + j, idx + j
+        ok = (lo >= 0) & (hi < n)
+        span = np.maximum(s[idx] - s[np.clip(lo, 0, n - 1)], s[np.clip(hi, 0, n - 1)] - s[idx])
+        best = np.where(ok, np.minimum(best, span), best)
+    return np.sort(best)
+
+
+def knee(y):
+    '''Knee of a sorted increasing curve: the point farthest below the chord of the normalized curve'''
+    x = np.linspace(0, 1, len(y))
+    y_n = (y - y[0]) / ((y[-1] - y[0]) or 1)
+    return y[int(np.argmax(x - y_n))]
+
+
+def estimate_eps(values, min_samples, sample_size=None, knee_quantile=0.995, random_state=1):
+    '''DBSCAN eps from the sorted min_samples-th neighbor distances of a sample (instead of a kNN of all values).
+       The notebook plotted distances[:, 1] (the nearest other value) and read eps from it by eye; the
+       min_samples-th neighbor distance is the usual heuristic (the neighborhood of a core value), and
+       gives a different eps than the notebook's 150
+    '''
+    distances = kth_distances(values, min_samples, sample_size, random_state)
+    return float(knee(distances[:int(np.ceil(knee_quantile * len(distances)))]))
+
+
+def core_values(values, eps, min_samples):
+    '''Sorted DBSCAN core values: at least min_samples values (self included) within eps. 1D: counts by binary search'''
+    s = np.sort(values)
+    counts = np.searchsorted(s, s + eps, side='right') - np.searchsorted(s, s - eps, side='left')
+    return s[counts >= min_samples]
+
+
+def fit(method, values, **params):
+    '''Detector fitted to the values (array or iterable of chunks): a dict with the method, its parameters
+       and the fitted state (statistics or model), for score
+    '''
+    params = detector_params(method, params)
+    detector = {'method': method, 'params': params}
+    with stage(f"outliers.fit.{method}") as info:
+        if method == 'iqr':
+            counts = sum(histogram(chunk, params['bins'], params['power']) for chunk in chunks(values))
+            q1, q3 = histogram_quantiles(counts, [0.25, 0.75], params['power'])
+            detector.update(low=q1 - params['k'] * (q3 - q1), high=q3 + params['k'] * (q3 - q1), n=int(counts.sum()))
+        elif method == 'zscore':
+            m = {'n': 0, 'mean': 0., 'm2': 0.}
+            for chunk in chunks(values):
+                m = merge_moments(m, moments(chunk ** params['power']))
+            detector.update(mean=m['mean'], std=np.sqrt(m['m2'] / m['n']), n=m['n'])
+        else:
+            values = np.concatenate(list(chunks(values)))
+            detector['n'] = len(values)
+            if method == 'dbscan':
+                eps = params['eps']
+                if eps is None:
+                    eps = estimate_eps(values, params['min_samples'], params['sample_size'], params['knee_quantile'], params['random_state'])
+                detector.update(eps=eps, cores=core_values(values, eps, params['min_samples']))
+            elif method == 'isoforest':
+                from sklearn.ensemble import IsolationForest
+
+                model = IsolationForest(max_samples=params['max_samples'], random_state=params['random_state'])
+                detector['model'] = model.fit(values.reshape(-1, 1))
+            elif method == 'lof':
+                from sklearn.neighbors import LocalOutlierFactor
+
+                sample = values
+                if params['sample_size'] is not None and params['sample_size'] < len(values):
+                    sample = np.random.default_rng(params['random_state']).choice(values, params['sample_size'], replace=False)
+                model = LocalOutlierFactor(n_neighbors=params['n_neighbors'], contamination=params['contamination'], novelty=True)
+                detector['model'] = model.fit(sample.reshape(-1, 1))
+                if sample is values:
+                    # Flags of the fitted values as fit_predict (scoring them as new records counts each as its own neighbor)
+                    detector['fit_outliers'] = model.negative_outlier_factor_ < model.offset_
+        info['rows'] = detector['n']
+    return detector
+
+
+def score_batch(detector, batch):
+    method = detector['method']
+    if method == 'iqr':
+        return (batch < detector['low']) | (batch > detector['high'])
+    if method == 'zscore':
+        return np.abs(batch ** detector['params']['power'] - detector['mean']) / detector['std'] > detector['params']['threshold']
+    if method == 'dbscan':
+        # Noise: not within eps of a core value (border values are)
+        cores = detector['cores']
+        if not len(cores):
+            return np.ones(len(batch), dtype=bool)
+        i = np.searchsorted(cores, batch)
+        nearest = np.minimum(np.abs(batch - cores[np.maximum(i - 1, 0)]), np.abs(batch - cores[np.minimum(i, len(cores) - 1)]))
+        return nearest > detector['eps']
+    return detector['model'].predict(batch.reshape(-1, 1)) == -1
+
+
+def score(detector, values, batch_size=BATCH_SIZE):
+    '''Outlier flags (True: outlier) of new values (array or iterable of chunks), scored in batches'''
+    with stage(f"outliers.score.{detector['method']}") as info:
+        flags = [score_batch(detector, batch) for batch in chunks(values, batch_size)]
+        flags = np.concatenate(flags) if flags else np.zeros(0, dtype=bool)
+        info['rows'] = len(flags)
+    return flags
+
+
+def detect(method, values, **params):
+    '''(detector, flags of the values) as the notebook outlier analysis'''
+    if not isinstance(values, (np.ndarray, pd.Series, pd.Index)):
+        # Fitted and scored: chunks are read twice, which an iterator (e.g. a generator) cannot do
+        values = np.concatenate(list(chunks(values)))
+    detector = fit(method, values, **params)
+    flags = detector.get('fit_outliers')
+    return detector, score(detector, values) if flags is None else flags
+
+
+@memoize(OUTLIER_CACHE)
+def monthly_detector(data, method, params=None):
+    '''Detector fitted to the monthly passenger counts per airline and region (sfo.SFOData.monthly)'''
+    return detect(method, data.monthly['Passenger Count'].to_numpy(), **(params or {}))
+
+
+@memoize(OUTLIER_CACHE)
+def monthly_outliers(data, method, params=None, min_year=None, max_year=None, geo_summary=None):
+    '''Rows of the monthly traffic flagged by a detector (fitted once to all months), optionally in
+       [min_year, max_year] and of the flights in geo_summary
+    '''
+    _, flags = monthly_detector(data, method, params)
+    df = data.monthly[flags]
+    if min_year is not None:
+        df = df[df['Year'].between(min_year, max_year)]
+    if geo_summary is not None:
+        df = df[df['GEO Summary'].isin(geo_summary)]
+    return df
+
+
+def report(name, flags):
+    n, outl_num = len(flags), int(np.count_nonzero(flags))
+    return f"{name}: all {n}, outliers {outl_num} ({100 * outl_num / n:.2f}%), rest {n - outl_num} ({100 * (n - outl_num) / n:.2f}%)"
+
+
+if __name__ == '__main__':
+    from sfo import load_data
+
+    part_b_fld = Path().absolute() / 'Data' / 'Part-B'
+    parser = argparse.ArgumentParser(description='Outliers of the Part B passenger counts by the detectors of the notebook')
+    parser.add_argument('--method', choices=list(DETECTORS), nargs='+', default=list(DETECTORS), help='Detectors')
+    parser.add_argument('--table', choices=['passengers', 'monthly'], default='passengers', help='passengers: rows of the dataset (as the notebook), monthly: per month, airline and region')
+    parser.add_argument('--estimate-eps', action='store_true', help='DBSCAN eps from the neighbor distances instead of the notebook value')
+    parser.add_argument('--data-fld', type=Path, default=part_b_fld, help='Folder of the Part B archives')
+    args = parser.parse_args()
+
+    data = load_data(args.data_fld, args.data_fld / 'Store')
+    table = data.monthly if args.table == 'monthly' else data.tables['passengers']
+    values = table['Passenger Count'].to_numpy()
+    for method in args.method:
+        detector, flags = detect(method, values, **({'eps': None} if method == 'dbscan' and args.estimate_eps else {}))
+        extra = f", eps {detector['eps']:.1f}" if method == 'dbscan' else ''
+        print(report(method, flags) + extra)
@@ -1,15 +1,33 @@
 import numpy as np
 import pandas as pd
-from PIL import Image
-import plotly.express as px
 import streamlit as st
 import streamlit.components.v1 as components
 from streamlit_option_menu import option_menu
 
 from pathlib import Path
 
+from analytics import airline_traffic, average_flights, busiest_airports, load_data, traffic_correlation, us_foreign_share
+from cache import LRUCache, memoize
+from figures import compact_figure, plotly_chart
+from perf import stage
+
+# Values derived from the (process wide) analysis data
+DATA_CACHE = LRUCache('part_a_data', maxsize=32)
+# Plotly figures (compacted) keyed by the analysis data and the widget values
+FIGURE_CACHE = LRUCache('part_a_figures', maxsize=128, ttl=60 * 60)
+
 class PartA:
+    '''Part A pages. The analysis data is loaded on first use (only the analysis page needs it)
+       and plotly/PIL are imported by the pages that use them, so the static pages render immediately
+    '''
     def __init__(self):
+        self.selected = None
+        self.cwd = Path().parent.absolute()
+        self.data_fld = self.cwd / 'Data' / 'Part-A' / 'Export'
+        self.store_fld = self.cwd / 'Data' / 'Part-A' / 'Store'
+        self._data = None
+
+    def select_page(self):
         self.selected = option_menu(
             menu_title=None,
             options = ['Data Info', 'A) Preparation', 'B) Analysis'],
@@ -18,38 +36,41 @@ class PartA:
             orientation='horizontal',
             default_index=0,
         )
-        self.cwd = Path().parent.absolute()
-        self.data_fld = self.cwd / 'Data' / 'Part-A' / 'Export'
-        self.data_dict = self.load_analysis_data()
+        # Data of the previous run, the page using it refreshes it
+        self._data = None
+        return self.selected
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = PartA.load_analysis_data(self.store_fld, self.data_fld)
+            # Pick up the months appended to the store since the data was loaded
+            self._data.refresh(self.store_fld, self.data_fld)
+        return self._data
+
+    @staticmethod
+    def airline_options(data):
+        return list(data.lookups['airline_labels'])
 
     @staticmethod
-    @st.cache
-    def airline_options(flights, airlines):
-        x = flights['airline_id'].sort_values()
-        y = x.map(airlines[['id', 'name']].set_index('id').squeeze())
-        airline_options = list(x.str.cat(y, ' | ').unique())
-        return airline_options
-
-    @st.cache
+    def ranking(labels):
+        ranks = pd.Series(range(1, len(labels) + 1)).astype(str).str.zfill(2)
+        return '\n\n'.join('| ' + ranks + ' | ' + labels.reset_index(drop=True))
+
     def min_max_years(self):
-        years = self.data_dict['dates']['year'].sort_values().unique()
-        _min = int(years.min())
-        _max = int(years.max())
-        return _min, _max
-
-    @st.cache
-    def load_analysis_data(self):
-        data_dict = {
-            'flights': pd.read_csv(self.data_fld / 'flights.zip', keep_default_na=False, na_values='', encoding='utf-8'),
-            'airlines': pd.read_csv(self.data_fld / 'airlines.zip', keep_default_na=False, na_values='', encoding='utf-8'),
-            'airports': pd.read_csv(self.data_fld / 'airports.zip', keep_default_na=False, na_values='', encoding='utf-8'),
-            'countries': pd.read_csv(self.data_fld / 'countries.zip', keep_default_na=False, na_values='', encoding='utf-8'),
-            'dates': pd.read_csv(self.data_fld / 'dates.zip', keep_default_na=False, na_values='', encoding='utf-8'),
-            'days': pd.read_csv(self.data_fld / 'days.zip', keep_default_na=False, na_values='', encoding='utf-8'),
-            'months': pd.read_csv(self.data_fld / 'months.zip', keep_default_na=False, na_values='', encoding='utf-8'),
-            'seasons': pd.read_csv(self.data_fld / 'seasons.zip', keep_default_na=False, na_values='', encoding='utf-8'),
-        }
-        return data_dict
+        return PartA.year_range(self.data)
+
+    @staticmethod
+    @memoize(DATA_CACHE)
+    def year_range(data):
+        years = data.tables['dates']['year']
+        return int(years.min()), int(years.max())
+
+    @staticmethod
+    @st.experimental_singleton
+    def load_analysis_data(store_fld, data_fld):
+        # One read-only copy (tables, enriched flights, cubes) shared by all sessions, built once per process
+        return load_data(store_fld, data_fld)
     
     def display_info_page(self):
         st.markdown(f"### Data preparation and analysis on U.S. International Air Traffic data(1990-2020):")
@@ -89,6 +110,8 @@ class PartA:
             """)
 
     def display_preparation_page(self):
+        from PIL import Image
+
         st.markdown(f"## Final Tables diagram")
         st.markdown(f"[Draw SQL free online tool](https://drawsql.app/teams/akotronis-team/diagrams/project-1)")
         part_a_img = Image.open(self.cwd / 'resources' / 'PartA-diagram.jpg')
@@ -128,12 +151,81 @@ class PartA:
         #     content = f.read()
         # components.html(content, height=800, scrolling=True)
 
-    def display_analysis_sc1(self):
-        airports = self.data_dict['airports']
-        dates = self.data_dict['dates']
-        flights = self.data_dict['flights'].copy()
+    @staticmethod
+    @memoize(FIGURE_CACHE)
+    def airports_figures(data, min_year, max_year, nlargest):
+        import plotly.express as px
+
+        df_grouped_tot, df_grouped_year = busiest_airports(data, min_year, max_year, nlargest)
+        with stage('sc1.figures', rows=len(df_grouped_year)):
+            airports_figure_tot = px.bar(
+                df_grouped_tot,
+                x='Airports',
+                y='Passengers (N)',
+                color='Passengers (N)',
+                template='plotly_white',
+                title='',
+            )
+            if min_year == max_year:
+                return compact_figure(airports_figure_tot), None
+            airports_figure_by_year = px.line(
+                df_grouped_year,
+                x="Year",
+                y="Passengers (N)",
+                color='Airports',
+                template="plotly_white",
+                markers=True,
+            )
+            airports_figure_by_year.update_traces(
+                line=dict(width=3.0),
+                marker=dict(size=6.0),
+            )
+            return compact_figure(airports_figure_tot), compact_figure(airports_figure_by_year)
+
+    @staticmethod
+    @memoize(FIGURE_CACHE)
+    def flight_types_figure(data, airline_id, min_year, max_year, period_type, flight_type):
+        import plotly.express as px
+
+        df_grouped = average_flights(data, airline_id, min_year, max_year, period_type, flight_type)
+        with stage('sc2.figures', rows=len(df_grouped)):
+            y_axis = f"{flight_type.title()} (avg)"
+            return compact_figure(px.bar(
+                df_grouped,
+                x=period_type.title(),
+                y=y_axis,
+                color=y_axis,
+                template='plotly_white',
+                title='',
+            ))
+
+    @staticmethod
+    @memoize(FIGURE_CACHE)
+    def us_foreign_figures(data, min_year, max_year):
+        import plotly.express as px
+
+        df_grouped, df_total = us_foreign_share(data, min_year, max_year)
+        with stage('sc3.figures', rows=len(df_grouped)):
+            us_airline_figure_1 = px.bar(
+                df_grouped,
+                x="year",
+                y="US/Foreign (%)",
+                color="US/Foreign",
+                color_discrete_map={
+                    'Foreign': '#EF553B',
+                    'US': '#636EFA'
+                },
+                title=''
+            )
+            us_airline_figure_2 = px.pie(
+                df_total,
+                title='',
+                values='count',
+                names='US/Foreign',
+            )
+            return compact_figure(us_airline_figure_1), compact_figure(us_airline_figure_2)
 
-        flights['year'] = flights['date_id'].map(dates[['id', 'year']].set_index('id').squeeze())
+    def display_analysis_sc1(self):
         ################################################################
         ######################## 1 TOP AIRPORTS ########################
         ################################################################
@@ -153,73 +245,23 @@ class PartA:
         min_year_1, max_year_1 = year_values_1
         nlargest_airports = st.number_input("Enter number for top busiest US airports (1-20):", min_value=1, max_value=20, step=1, value=5, format="%i", key='lrg1')
         
-        df = flights.copy()
-        df = df.loc[df['year'].isin(range(min_year_1, max_year_1 + 1))]
-        keep_columns = [
-            'year',
-            'airport_usa_id',
-            'psg_total_flights',
-        ]
-        df = df[keep_columns]
-        df_grouped_year = df.groupby(['airport_usa_id', 'year']).sum()
-        df_grouped_tot = df_grouped_year.groupby(['airport_usa_id']).sum()
-        df_grouped_tot = df_grouped_tot.nlargest(nlargest_airports, 'psg_total_flights').reset_index()
-        df_grouped_tot['airport_name'] = df_grouped_tot['airport_usa_id'].map(airports[['id', 'name']].set_index('id').squeeze())
-        df_grouped_tot = df_grouped_tot.rename(columns={'psg_total_flights':'Passengers (N)', 'airport_usa_id':'Airports'})
-
-        df_grouped_year = df_grouped_year[df_grouped_year.index.get_level_values(0).isin(df_grouped_tot['Airports'])].reset_index()
-        df_grouped_year = df_grouped_year.rename(columns={'year':'Year', 'psg_total_flights':'Passengers (N)', 'airport_usa_id':'Airports'})
-        airport_dict = pd.Series(df_grouped_tot['Airports'].index.values, index=df_grouped_tot['Airports'])
-        df_grouped_year['sort'] = df_grouped_year['Airports'].map(airport_dict)
-        df_grouped_year = df_grouped_year.sort_values(['sort', 'Year'])
-        
+        df_grouped_tot, _ = busiest_airports(self.data, min_year_1, max_year_1, nlargest_airports)
+        airports_figure_tot, airports_figure_by_year = PartA.airports_figures(self.data, min_year_1, max_year_1, nlargest_airports)
+
         year_range = f"{min_year_1}-{max_year_1}" if min_year_1 != max_year_1 else f"{min_year_1}"
         airports_title_tot = f"{nlargest_airports} busiest US airports in {year_range}" if nlargest_airports > 1 else f"Busiest US airport in {min_year_1}-{max_year_1}"
         st.markdown(f"### {airports_title_tot}")
-        airports_figure_tot = px.bar(
-            df_grouped_tot,
-            x='Airports',
-            y='Passengers (N)',
-            color='Passengers (N)',
-            template='plotly_white',
-            title='',
-        )
-        st.plotly_chart(airports_figure_tot)
-        top_airports = df_grouped_tot[['Airports', 'airport_name']].apply(lambda r: f"{r['Airports']}: {r['airport_name']}", axis='columns')
-        top_airports = top_airports.reset_index(drop=True)
-        top_airports.index = top_airports.index + 1
-        top_airports = top_airports.index.map(lambda x : f"| {str(x).zfill(2)}").str.cat(top_airports.values, sep=' | ')
+        plotly_chart(airports_figure_tot)
+        top_airports = df_grouped_tot['Airports'].astype(str) + ': ' + df_grouped_tot['airport_name'].astype(str)
         st.markdown("### Airport Ranking:")
-        st.markdown('\n\n'.join(top_airports))
+        st.markdown(PartA.ranking(top_airports))
 
         if min_year_1 != max_year_1:
             airports_title_by_year = f"{nlargest_airports} busiest US airports in {year_range}" if nlargest_airports > 1 else f"Busiest US airport in {min_year_1}-{max_year_1} by year"
             st.markdown(f"### {airports_title_by_year}")
-
-            airports_figure_by_year = px.line(
-                df_grouped_year,
-                x="Year",
-                y="Passengers (N)",
-                color='Airports',
-                template="plotly_white",
-                markers=True,
-            )
-            airports_figure_by_year.update_traces(
-                line=dict(width=3.0),
-                marker=dict(size=6.0),
-            )
-            st.plotly_chart(airports_figure_by_year)
+            plotly_chart(airports_figure_by_year)
 
     def display_analysis_sc2(self):
-        airlines = self.data_dict['airlines']
-        dates = self.data_dict['dates']
-        months = self.data_dict['months']
-        seasons = self.data_dict['seasons']
-        flights = self.data_dict['flights'].copy()
-
-        flights['month'] = flights['date_id'].map(dates[['id', 'month']].set_index('id').squeeze()).map(months[['id', 'month']].set_index('id').squeeze())
-        flights['year'] = flights['date_id'].map(dates[['id', 'year']].set_index('id').squeeze())
-        flights['season'] = flights['date_id'].map(dates[['id', 'season_id']].set_index('id').squeeze()).map(seasons[['id', 'season']].set_index('id').squeeze())
         ################################################################
         ####################### 2 FLIGHT TYPES #########################
         ################################################################
@@ -253,48 +295,21 @@ class PartA:
         )
         selected_flight_type = selected_flight_type[0].lower() if len(selected_flight_type) == 1 else 'total'
         
-        airline_options = PartA.airline_options(flights, airlines)
+        airline_options = PartA.airline_options(self.data)
         selected_airline = st.selectbox(
             'Select airline:',
             airline_options,
             key='slb2',
         )
+        airline_id = selected_airline.split('|')[0].strip()
 
-        df = flights.copy()
-        mask1 = df['year'].isin(range(min_year_2, max_year_2 + 1))
-        mask2 = df['airline_id'] == selected_airline.split('|')[0].strip()
-        df = df.loc[mask1 & mask2]
-        keep_columns = [
-            'year',
-        ]
-        keep_columns.extend([selected_period_type, f"dep_{selected_flight_type}_flights"])
-        df = df[keep_columns]
-        df_grouped = df.groupby([selected_period_type, 'year']).sum().groupby(selected_period_type).mean().round(0).applymap(int).reset_index()
-        y_axis = f"{selected_flight_type.title()} (avg)"
-        df_grouped = df_grouped.rename(columns={
-            selected_period_type: selected_period_type.title(),
-            f"dep_{selected_flight_type}_flights": y_axis,
-        })
-        df_grouped = df_grouped.sort_values(y_axis, ascending=False)
-        
         selected_flight_type_title = '' if selected_flight_type == 'total' else f" {selected_flight_type}"
         flight_type_title = f"Average{selected_flight_type_title} flights per {selected_period_type} in {min_year_2}-{max_year_2} | {selected_airline}"
         st.markdown(f"### {flight_type_title}")
-        airports_figure = px.bar(
-            df_grouped,
-            x=selected_period_type.title(),
-            y=y_axis,
-            color=y_axis,
-            template='plotly_white',
-            title='',
-        )
-        st.plotly_chart(airports_figure)
+        airports_figure = PartA.flight_types_figure(self.data, airline_id, min_year_2, max_year_2, selected_period_type, selected_flight_type)
+        plotly_chart(airports_figure)
 
     def display_analysis_sc3(self):
-        dates = self.data_dict['dates']
-        flights = self.data_dict['flights'].copy()
-
-        flights['year'] = flights['date_id'].map(dates[['id', 'year']].set_index('id').squeeze())
         ################################################################
         ##################### 3 US/FOREIGN AIRLINES ####################
         ################################################################
@@ -311,52 +326,19 @@ class PartA:
         year_values_3 = st.slider('Select a range of years', _min, _max, (_min, _max), key='sld3')
         min_year_3, max_year_3 = year_values_3
 
-        df = flights.copy()
-        keep_columns = [
-            'year',
-            'us_foreign_airline',
-        ]
-        df = df[keep_columns]
-        df = df.loc[df['year'].isin(range(min_year_3, max_year_3 + 1))]
+        us_airline_figure_1, us_airline_figure_2 = PartA.us_foreign_figures(self.data, min_year_3, max_year_3)
 
         # By year
-        df['US/Foreign'] = df['us_foreign_airline'].map({0:'Foreign', 1:'US'})
-        df_grouped = df.groupby(['year', 'US/Foreign']).count().reset_index()
-        df_grouped = df_grouped.rename(columns={'us_foreign_airline':'count'}).sort_values('US/Foreign', ascending=False)
-        df_grouped['US/Foreign (%)'] = (100 * df_grouped['count'] / df_grouped.groupby('year')['count'].transform('sum')).round(0)
-
         us_airline_title_1 = f"US/Foreign airline representation per year in {min_year_3}-{max_year_3}"
         st.markdown(f"### {us_airline_title_1}")
-        us_airline_figure_1 = px.bar(
-            df_grouped,
-            x="year",
-            y="US/Foreign (%)",
-            color="US/Foreign",
-            color_discrete_map={
-                'Foreign': '#EF553B',
-                'US': '#636EFA'
-            },
-            title=''
-        )
-        st.plotly_chart(us_airline_figure_1)
+        plotly_chart(us_airline_figure_1)
 
         # Total
-        df_grouped = df_grouped[['US/Foreign', 'count']].groupby(['US/Foreign']).sum().reset_index().sort_values('US/Foreign', ascending=False)
         us_airline_title_2 = f"US/Foreign airline representation in {min_year_3}-{max_year_3}"
         st.markdown(f"### {us_airline_title_2}")
-        us_airline_figure_2 = px.pie(
-            df_grouped,
-            title='',
-            values='count',
-            names='US/Foreign',
-        )
-        st.plotly_chart(us_airline_figure_2)
+        plotly_chart(us_airline_figure_2)
 
     def display_analysis_sc4(self):
-        airlines = self.data_dict['airlines']
-        countries = self.data_dict['countries']
-        flights = self.data_dict['flights'].copy()
-
         ################################################################
         ####################### 4 AIRLINE TRAFFIC ######################
         ################################################################
@@ -364,10 +346,7 @@ class PartA:
         st.markdown("##### Airlines traffic is investigated taking into account the number of passengers and the number of flights")
         st.markdown("""Flights and passengers are correlated but characterize traffic in a different way since passengers directly map to profit but flights may not if plains are not full""")
         st.markdown("""Correlation matrix:""")
-        st.dataframe(flights[['psg_total_flights', 'dep_total_flights']].rename(columns={
-            'psg_total_flights':'passengers',
-            'dep_total_flights':'flights',
-        }).corr())
+        st.dataframe(traffic_correlation(self.data))
         
         st.markdown("""We define traffic as linear combination of passengers and flights.""")
         st.markdown("""Weight $x$ is selected for the passengers factor (0-10) and flights will be assigned $1-x/10$""")
@@ -387,7 +366,7 @@ class PartA:
             key='ms2',
         )
         airline_selection = airline_selection if airline_selection else ('US', 'Foreign')
-        airline_selection = [{'US':1, 'Foreign':0}[s] for s in airline_selection]
+        airline_selection = tuple(sorted({'US':1, 'Foreign':0}[s] for s in airline_selection))
 
         pass_wgt = st.number_input("Enter number as a weight for flight passenger number (0-10):", min_value=0, max_value=10, step=1, value=5, format="%i")
         pass_wgt = pass_wgt / 10.
@@ -396,29 +375,11 @@ class PartA:
         st.markdown(f"#### Weighted: ${pass_wgt:.1f}\cdot\mathrm{{passengers\;N}}\;+\;{dep_wgt:.1f}\cdot\mathrm{{flights\;N}}$")
         nlargest_airlines = st.number_input("Enter number for top busiest airlines (1-20):", min_value=1, max_value=20, step=1, value=5, format="%i", key='lrg2')
         
-        df = flights.copy()
-        df = df.loc[df['us_foreign_airline'].isin(airline_selection)]
-        
-        # min-max normalization
-        col1 = pass_wgt * (df['psg_total_flights'] - df['psg_total_flights'].min()) / (df['psg_total_flights'].max() - df['psg_total_flights'].min())
-        col2 = dep_wgt * (df['dep_total_flights'] - df['dep_total_flights'].min()) / (df['dep_total_flights'].max() - df['dep_total_flights'].min())
-        df['weighted'] =  col1 + col2
-        keep_columns = [
-            'airline_id',
-            'weighted',
-        ]
-        df = df[keep_columns]
-        df_grouped = df.groupby('airline_id').sum().reset_index()
-        df_grouped = df_grouped.sort_values('weighted', ascending=False).nlargest(nlargest_airlines, 'weighted')
-        df_grouped['country'] = df_grouped['airline_id'].map(airlines[['id', 'country_id']].set_index('id').squeeze()).map(countries[['id', 'name']].set_index('id').squeeze())
-        df_grouped['name'] = df_grouped['airline_id'].map(airlines[['id', 'name']].set_index('id').squeeze())
-
-        top_airlines = df_grouped.apply(lambda r: f"{r['airline_id']}: {r['name']} | {r['country']}", axis='columns')
-        top_airlines = top_airlines.reset_index(drop=True)
-        top_airlines.index = top_airlines.index + 1
-        top_airlines = top_airlines.index.map(lambda x : f"| {str(x).zfill(2)}").str.cat(top_airlines.values, sep=' | ')
+        df_grouped = airline_traffic(self.data, airline_selection, pass_wgt, nlargest_airlines)
+
+        top_airlines = df_grouped['airline_id'].astype(str) + ': ' + df_grouped['name'].astype(str) + ' | ' + df_grouped['country'].astype(str)
         st.markdown("### Airlines Ranking:")
-        st.markdown('\n\n'.join(top_airlines))
+        st.markdown(PartA.ranking(top_airlines))
 
     def display_analysis_page(self):
         with st.sidebar:
@@ -430,14 +391,15 @@ class PartA:
                 orientation='vertical',
                 default_index=0,
             )
-        if main_selected == 'Scenario 1':
-            self.display_analysis_sc1()
-        elif main_selected == 'Scenario 2':
-            self.display_analysis_sc2()
-        elif main_selected == 'Scenario 3':
-            self.display_analysis_sc3()
-        elif main_selected == 'Scenario 4':
-            self.display_analysis_sc4()
+        with stage(f"page.{main_selected}"):
+            if main_selected == 'Scenario 1':
+                self.display_analysis_sc1()
+            elif main_selected == 'Scenario 2':
+                self.display_analysis_sc2()
+            elif main_selected == 'Scenario 3':
+                self.display_analysis_sc3()
+            elif main_selected == 'Scenario 4':
+                self.display_analysis_sc4()
         
         
         
@@ -1,13 +1,196 @@
-import numpy as np
 import pandas as pd
-from pathlib import Path
 import streamlit as st
+from streamlit_option_menu import option_menu
+
+from pathlib import Path
+
+from cache import LRUCache, memoize
+from figures import compact_figure, plotly_chart
+import models
+from outliers import DETECTORS, monthly_outliers
+from perf import stage
+from sfo import QUERY_CACHE, load_data, monthly_series, region_passengers, top_airlines
+
+# Values derived from the (process wide) data
+DATA_CACHE = LRUCache('part_b_data', maxsize=8)
+# Plotly figures (compacted) keyed by the data and the widget values
+FIGURE_CACHE = LRUCache('part_b_figures', maxsize=128, ttl=60 * 60)
+GEO_SUMMARIES = ('Domestic', 'International')
 
 class PartB:
+    '''Part B pages (San Francisco International Airport passengers and landings).
+       The data is loaded on first use, once per process, as in Part A
+    '''
     def __init__(self):
-        self.data_dict = {}
+        self.selected = None
         self.data_fld = Path().absolute() / 'Data' / 'Part-B'
+        self.store_fld = self.data_fld / 'Store'
+        self._data = None
+
+    def select_page(self):
+        self.selected = option_menu(
+            menu_title=None,
+            options = ['Data Info', 'Analysis', 'Models'],
+            icons = ['caret-down', 'caret-down', 'caret-down'],
+            menu_icon=None,
+            orientation='horizontal',
+            default_index=0,
+        )
+        return self.selected
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = PartB.load_sfo_data(self.data_fld, self.store_fld)
+        return self._data
+
+    @staticmethod
+    @st.experimental_singleton
+    def load_sfo_data(data_fld, store_fld):
+        # One read-only copy (typed tables and their monthly join) shared by all sessions, built once per process
+        return load_data(data_fld, store_fld)
+
+    def display_info_page(self):
+        st.markdown(f"### San Francisco International Airport Air Traffic Statistics (2005-2022):")
+        st.markdown(f"#### Data sources:")
+        st.markdown(f"""
+            - [Air Traffic Passenger Statistics](https://catalog.data.gov/dataset/air-traffic-passenger-statistics)
+            - [Air Traffic Landings Statistics](https://catalog.data.gov/dataset/air-traffic-landings-statistics)
+        """)
+        st.markdown(f"#### Tables:")
+        st.markdown(f"""
+            - Rows of inactive airlines and without an operating airline IATA code are removed
+            - Airline, region, terminal and aircraft fields are categoricals, counts unsigned integers
+            - Passengers are joined to the landings of passenger aircraft per month, airline and region
+        """)
+        st.dataframe(PartB.tables_info(self.data))
+
+    @staticmethod
+    @memoize(DATA_CACHE)
+    def tables_info(data):
+        return pd.DataFrame([
+            {'table': name, 'rows': len(df), 'columns': df.shape[1], 'memory (MB)': round(df.memory_usage(deep=True).sum() / 2 ** 20, 2)}
+            for name, df in dict(data.tables, monthly=data.monthly).items()
+        ]).set_index('table')
+
+    @staticmethod
+    @memoize(FIGURE_CACHE)
+    def monthly_figure(data, min_year, max_year, geo_summary):
+        import plotly.express as px
+
+        df = monthly_series(data, min_year, max_year, geo_summary)
+        with stage('sfo.figures', rows=len(df)):
+            return compact_figure(px.line(
+                df,
+                x='Month',
+                y=['Passengers', 'Landings'],
+                facet_row='variable',
+                template='plotly_white',
+                title='',
+            ).update_yaxes(matches=None, title='').for_each_annotation(lambda a: a.update(text=a.text.split('=')[-1])))
+
+    @staticmethod
+    @memoize(FIGURE_CACHE)
+    def airlines_figure(data, min_year, max_year, geo_summary, nlargest):
+        import plotly.express as px
+
+        df = top_airlines(data, min_year, max_year, geo_summary, nlargest)
+        with stage('sfo.figures', rows=len(df)):
+            return compact_figure(px.bar(
+                df,
+                x='IATA',
+                y='Passengers',
+                color='Passengers per landing',
+                hover_data=['Airline', 'Landings'],
+                template='plotly_white',
+                title='',
+            ))
+
+    @staticmethod
+    @memoize(FIGURE_CACHE)
+    def regions_figure(data, min_year, max_year, geo_summary):
+        import plotly.express as px
+
+        df = region_passengers(data, min_year, max_year, geo_summary)
+        with stage('sfo.figures', rows=len(df)):
+            return compact_figure(px.pie(df, values='Passengers', names='Region', title=''))
+
+    def display_analysis_page(self):
+        _min, _max = self.data.year_range()
+        min_year, max_year = st.slider('Select a range of years:', _min, _max, (_min, _max), key='pb_sld1')
+        geo_summary = st.multiselect('Include flights:', GEO_SUMMARIES, default=GEO_SUMMARIES, key='pb_ms1')
+        geo_summary = tuple(sorted(geo_summary)) if geo_summary else GEO_SUMMARIES
+        nlargest = st.number_input("Enter number for top airlines (1-20):", min_value=1, max_value=20, step=1, value=10, format="%i", key='pb_lrg1')
+
+        with stage('page.Part B'):
+            st.markdown(f"### Passengers and landings per month in {min_year}-{max_year}")
+            plotly_chart(PartB.monthly_figure(self.data, min_year, max_year, geo_summary))
+
+            st.markdown(f"### {nlargest} airlines with the most passengers in {min_year}-{max_year}")
+            st.dataframe(top_airlines(self.data, min_year, max_year, geo_summary, nlargest))
+            plotly_chart(PartB.airlines_figure(self.data, min_year, max_year, geo_summary, nlargest))
+
+            st.markdown(f"### Passengers per region in {min_year}-{max_year}")
+            plotly_chart(PartB.regions_figure(self.data, min_year, max_year, geo_summary))
+
+        method = st.selectbox('Outlier detector:', list(DETECTORS), key='pb_slb3')
+        with stage('page.Part B outliers'):
+            # Detectors are fitted once to all months (cached per configuration), the range only filters the flags
+            df = monthly_outliers(self.data, method, None, min_year, max_year, geo_summary)
+            st.markdown(f"### Anomalous monthly traffic in {min_year}-{max_year} ({method}): {len(df)} airline/region months")
+            st.dataframe(PartB.outliers_table(self.data, method, min_year, max_year, geo_summary))
+
+    @staticmethod
+    @memoize(QUERY_CACHE)
+    def outliers_table(data, method, min_year, max_year, geo_summary):
+        df = monthly_outliers(data, method, None, min_year, max_year, geo_summary)
+        df = df.assign(Airline=df['Operating Airline IATA Code'].map(data.lookups['airline_names']).astype(str))
+        df = df.rename(columns={'Operating Airline IATA Code': 'IATA', 'GEO Region': 'Region', 'Passenger Count': 'Passengers', 'Landing Count': 'Landings'})
+        return df[['Activity Period', 'IATA', 'Airline', 'Region', 'Passengers', 'Landings']].sort_values('Passengers', ascending=False).reset_index(drop=True)
+
+    @staticmethod
+    @memoize(DATA_CACHE)
+    def training_data(data, task):
+        # Train/test split of the notebook and the training data hash (model cache key), once per data and task
+        X_train, X_test, y_train, y_test = models.train_test(*models.prepare_data(data.tables['passengers'], task), task)
+        return X_train, X_test, y_train, y_test, models.data_hash(X_train, y_train)
+
+    @staticmethod
+    @memoize(DATA_CACHE)
+    def test_scores(data, task, result_key, _result):
+        # Keyed by the search result key (the result itself is not hashed)
+        _, X_test, _, y_test, _ = PartB.training_data(data, task)
+        return models.perf_on_input(_result['pipeline'], X_test, y_test, task)
+
+    def display_models_page(self):
+        tasks = {'Passenger count class': 'clf', 'Passenger count': 'rgr'}
+        task = tasks[st.selectbox('Predict:', list(tasks), key='pb_slb1')]
+        X_train, _, y_train, _, train_hash = PartB.training_data(self.data, task)
+        # Models are trained and persisted by the command line, the app only loads them
+        results = {}
+        for name in models.PARAM_GRIDS[task]:
+            result = models.search(task, name, X_train, y_train, fit=False, train_hash=train_hash)
+            if result is not None:
+                results[name] = result
+        if not results:
+            st.info('No trained models: from root folder `>>> python src/models.py`')
+            return
+        name = st.selectbox('Model:', list(results), key='pb_slb2')
+        result = results[name]
+
+        with stage('page.Part B models'):
+            st.markdown(f"### {name}: cv {result['metric']} {result['best_score']:.4f}")
+            st.write(result['best_params'])
+            st.markdown(f"#### Test set performance")
+            st.dataframe(pd.DataFrame([PartB.test_scores(self.data, task, result['key'], result)]))
 
-    @st.cache
-    def load_data(self):
-        return self.data_dict
\ No newline at end of file
+            st.markdown(f"#### Prediction")
+            values = {}
+            for c in X_train.columns:
+                if c == 'Month':
+                    values[c] = st.number_input('Month (1-12):', min_value=1, max_value=12, step=1, value=1, format="%i", key='pb_mi1')
+                else:
+                    values[c] = st.selectbox(f"{c}:", X_train[c].cat.categories if X_train[c].dtype == 'category' else sorted(X_train[c].unique()), key=f"pb_f_{c}")
+            X = pd.DataFrame([values]).astype(X_train.dtypes.to_dict())
+            prediction = models.predict(result, X)[0]
+            st.markdown(f"Predicted passenger count{' class' if task == 'clf' else ''}: **{prediction if task == 'clf' else round(prediction)}**")
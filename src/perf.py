@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Instrumentation is off unless DIT161_PERF is set (stages are then no-ops)
+ENABLED = os.environ.get('DIT161_PERF', '') not in ('', '0')
+# Structured (json lines) log of the stage events, if set
+LOG_PATH = os.environ.get('DIT161_PERF_LOG')
+
+logger = logging.getLogger('dit161.perf')
+
+
+class PerfRecorder:
+    '''Process wide per stage timings (calls, total/max seconds, rows processed, cache hits/misses)
+       and the latest stage events
+    '''
+    def __init__(self, max_events=1000):
+        self.stages = {}
+        self.events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, **info):
+        event = {'stage': name, 'seconds': seconds, 'time': time.time(), **info}
+        with self._lock:
+            stats = self.stages.setdefault(name, {'stage': name, 'calls': 0, 'total_seconds': 0., 'max_seconds': 0., 'rows': 0, 'hits': 0, 'misses': 0})
+            stats['calls'] += 1
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            stats['rows'] += info.get('rows') or 0
+            if 'cache' in info:
+                # hit: memory, disk: persistent result cache
+                stats['hits' if info['cache'] in ('hit', 'disk') else 'misses'] += 1
+            self.events.append(event)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(event, default=str))
+
+    def summary(self):
+        '''Stage stats, slowest (total seconds) first'''
+        with self._lock:
+            stages = [dict(s, mean_seconds=s['total_seconds'] / s['calls']) for s in self.stages.values()]
+        return sorted(stages, key=lambda s: s['total_seconds'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self.stages.clear()
+            self.events.clear()
+
+
+RECORDER = PerfRecorder()
+
+
+@contextmanager
+def stage(name, rows=None):
+    '''Times the block as stage `name`. Yields a dict for extra event info (e.g. rows, cache)'''
+    info = {} if rows is None else {'rows': rows}
+    if not ENABLED:
+        yield info
+        return
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        RECORDER.record(name, time.perf_counter() - start, **info)
+
+
+def report():
+    '''Stage stats, cache stats and latest events (json serializable)'''
+    from cache import cache_stats
+
+    return {
+        'stages': RECORDER.summary(),
+        'caches': cache_stats(),
+        'events': list(RECORDER.events),
+    }
+
+
+def configure_logging(path=LOG_PATH):
+    if logger.handlers:
+        return
+    # Stage events only go to the log file, never to the root handlers (the streamlit console)
+    logger.propagate = False
+    if not path:
+        logger.addHandler(logging.NullHandler())
+        return
+    handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+def perf_panel():
+    '''Sidebar panel with the stage and cache stats (only when instrumentation is enabled)'''
+    if not ENABLED:
+        return
+    import pandas as pd
+    import streamlit as st
+
+    with st.sidebar.expander('Performance', expanded=False):
+        data = report()
+        st.markdown('**Stages**')
+        st.dataframe(pd.DataFrame(data['stages']))
+        st.markdown('**Caches**')
+        st.dataframe(pd.DataFrame(data['caches']))
+        st.download_button('Export (json)', json.dumps(data, default=str, indent=2), file_name='perf.json', mime='application/json')
+        if st.button('Reset'):
+            RECORDER.clear()
+
+
+configure_logging()
@@ -0,0 +1,113 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import analytics
+from analytics import AIRLINE_GROUPS, DEFAULT_ENGINE, ENGINES, FLIGHT_TYPES, PERIOD_TYPES, evaluate, load_data
+from engine import SqlData
+
+# Analysis data of the worker processes (inherited read-only from the parent with fork)
+_DATA = None
+
+
+def year_ranges(min_year, max_year):
+    return [(a, b) for a in range(min_year, max_year + 1) for b in range(a, max_year + 1)]
+
+
+def scenario_tasks(data, sc2_ranges='full', max_nlargest=20):
+    '''Scenario parameter combinations of the app widgets:
+       all year ranges and top N for scenarios 1 and 3, all airlines, periods and flight types
+       for scenario 2 (full year range, each single year too if sc2_ranges is 'years', all ranges if 'all'),
+       all airline selections, weights and top N for scenario 4
+    '''
+    years = data.tables['dates']['year']
+    min_year, max_year = int(years.min()), int(years.max())
+    ranges = year_ranges(min_year, max_year)
+    top = range(1, max_nlargest + 1)
+
+    for (a, b), n in itertools.product(ranges, top):
+        yield 'busiest_airports', {'min_year': a, 'max_year': b, 'nlargest': n}
+
+    sc2 = {'full': [(min_year, max_year)], 'years': [(min_year, max_year)] + [(y, y) for y in range(min_year, max_year + 1)], 'all': ranges}[sc2_ranges]
+    airline_ids = [label.split('|')[0].strip() for label in data.lookups['airline_labels']]
+    for airline_id, (a, b), period_type, flight_type in itertools.product(airline_ids, sc2, PERIOD_TYPES, FLIGHT_TYPES):
+        yield 'average_flights', {'airline_id': airline_id, 'min_year': a, 'max_year': b, 'period_type': period_type, 'flight_type': flight_type}
+
+    for a, b in ranges:
+        yield 'us_foreign_share', {'min_year': a, 'max_year': b}
+
+    yield 'traffic_correlation', {}
+    # Same values as the app widgets: sorted selection of US (1)/Foreign (0), weight/10
+    selections = [(0,), (1,), tuple(sorted(AIRLINE_GROUPS.values()))]
+    for selection, weight, n in itertools.product(selections, range(11), top):
+        yield 'airline_traffic', {'airline_selection': selection, 'pass_wgt': weight / 10., 'nlargest': n}
+
+
+def init_worker(store_fld, export_fld, results_fld, engine_name):
+    global _DATA
+    # Not inherited with spawn
+    analytics.RESULT_CACHE.fld = results_fld
+    analytics.RESULT_CACHE.write = True
+    if _DATA is None:
+        # spawn start method: each worker loads the data (and opens its own duckdb connection)
+        _DATA = load_data(store_fld, export_fld, engine_name)
+
+
+def evaluate_chunk(tasks):
+    '''Evaluates tasks in a worker; results are written to the result cache by the memoized functions'''
+    for scenario, params in tasks:
+        evaluate(_DATA, scenario, params)
+    return len(tasks)
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def run(store_fld, export_fld, results_fld, processes=None, sc2_ranges='full', chunksize=200, clear=False, engine_name=DEFAULT_ENGINE):
+    '''Evaluates the scenario parameter combinations over a process pool and stores the results in
+       the persistent result cache of the app (results_fld, created if missing).
+       Results are keyed by the engine's data, so precompute with the engine of the app
+    '''
+    global _DATA
+    results_fld.mkdir(parents=True, exist_ok=True)
+    analytics.RESULT_CACHE.fld = results_fld
+    analytics.RESULT_CACHE.write = True
+    if clear:
+        analytics.RESULT_CACHE.clear()
+
+    start = time.perf_counter()
+    _DATA = load_data(store_fld, export_fld, engine_name)
+    tasks = list(scenario_tasks(_DATA, sc2_ranges))
+    print(f"data loaded in {time.perf_counter() - start:.1f}s, {len(tasks)} combinations")
+
+    # fork shares the loaded data with the workers (copy on write), spawn loads it in each worker.
+    # A duckdb connection is not fork safe: with the SQL engine each worker connects
+    sql = isinstance(_DATA, SqlData)
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() and not sql else 'spawn'
+    context = multiprocessing.get_context(method)
+    start = time.perf_counter()
+    done = 0
+    with context.Pool(processes, initializer=init_worker, initargs=(store_fld, export_fld, results_fld, 'duckdb' if sql else 'pandas')) as pool:
+        for n in pool.imap_unordered(evaluate_chunk, chunked(tasks, chunksize)):
+            done += n
+    print(f"{done} results -> {results_fld} in {time.perf_counter() - start:.1f}s ({method}, {processes or os.cpu_count()} processes)")
+    return done
+
+
+if __name__ == '__main__':
+    part_a_fld = Path().absolute() / 'Data' / 'Part-A'
+    parser = argparse.ArgumentParser(description='Precompute the Part A scenario results into the persistent result cache of the app')
+    parser.add_argument('--export-fld', type=Path, default=part_a_fld / 'Export', help='Folder of the exported tables')
+    parser.add_argument('--store-fld', type=Path, default=part_a_fld / 'Store', help='Folder of the parquet tables')
+    parser.add_argument('--results-fld', type=Path, default=analytics.RESULTS_FLD, help='Result cache folder (DIT161_RESULTS for the app)')
+    parser.add_argument('--engine', choices=ENGINES, default=DEFAULT_ENGINE, help='Query engine of the app (DIT161_ENGINE)')
+    parser.add_argument('--processes', type=int, help='Worker processes (default number of cpus)')
+    parser.add_argument('--sc2-ranges', choices=['full', 'years', 'all'], default='full', help='Year ranges of scenario 2: full range, also single years, or all ranges')
+    parser.add_argument('--clear', action='store_true', help='Remove the existing results first (e.g. of older data)')
+    args = parser.parse_args()
+    run(args.store_fld, args.export_fld, args.results_fld, args.processes, args.sc2_ranges, clear=args.clear, engine_name=args.engine)
@@ -0,0 +1,177 @@
+import argparse
+from pathlib import Path
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from cache import LRUCache, SharedData, memoize
+from perf import stage
+from store import apply_schema, fingerprint, stored_path
+
+# San Francisco International Airport datasets of Data/Part-B
+ARCHIVES = {
+    'passengers': 'Air_Traffic_Passenger_Statistics.zip',
+    'landings': 'Air_Traffic_Landings_Statistics.zip',
+}
+
+AIRLINE_COLUMNS = ['Operating Airline', 'Operating Airline IATA Code', 'Published Airline', 'Published Airline IATA Code']
+GEO_COLUMNS = ['GEO Summary', 'GEO Region']
+
+# Narrowest dtypes of the columns: the text fields are categoricals, parsed as such by read_csv
+SCHEMAS = {
+    'passengers': {
+        'Activity Period': 'uint32',
+        **{c: 'category' for c in AIRLINE_COLUMNS + GEO_COLUMNS},
+        **{c: 'category' for c in ['Activity Type Code', 'Price Category Code', 'Terminal', 'Boarding Area']},
+        'Passenger Count': 'uint32',
+    },
+    'landings': {
+        'Activity Period': 'uint32',
+        **{c: 'category' for c in AIRLINE_COLUMNS + GEO_COLUMNS},
+        **{c: 'category' for c in ['Landing Aircraft Type', 'Aircraft Body Type', 'Aircraft Manufacturer', 'Aircraft Model', 'Aircraft Version']},
+        'Landing Count': 'uint32',
+        'Total Landed Weight': 'uint64',
+    },
+}
+
+# Keys of the monthly join of passengers to landings (categoricals with the same categories in both tables)
+JOIN_KEYS = ['Activity Period', 'Operating Airline IATA Code', 'GEO Summary', 'GEO Region']
+
+# Memoized query results keyed by the data and the widget values
+QUERY_CACHE = LRUCache('part_b_queries', maxsize=256, ttl=60 * 60)
+
+
+def read_archive(data_fld, name):
+    '''Dataset of an archive, decoded with the dtypes of its schema'''
+    schema = SCHEMAS[name]
+    categories = {c: dtype for c, dtype in schema.items() if dtype == 'category'}
+    df = pd.read_csv(data_fld / ARCHIVES[name], dtype=categories, keep_default_na=False, na_values='', encoding='utf-8')
+    return apply_schema(df, name, SCHEMAS)
+
+
+def clean(df):
+    '''Rows of active airlines with an operating airline IATA code (as in the notebook), date columns added'''
+    inactive = df['Operating Airline'].str.contains('inactive', case=False) | df['Published Airline'].str.contains('inactive', case=False)
+    df = df.loc[~inactive & df['Operating Airline IATA Code'].notna()].reset_index(drop=True)
+    for c in df.columns:
+        if df[c].dtype == 'category':
+            df[c] = df[c].cat.remove_unused_categories()
+    period = df['Activity Period'].to_numpy()
+    df.insert(1, 'Year', (period // 100).astype('uint16'))
+    df.insert(2, 'Month', (period % 100).astype('uint8'))
+    return df
+
+
+def share_categories(tables, columns):
+    '''Same (sorted, union) categories for the columns of all tables, so joins and filters compare codes'''
+    for c in columns:
+        categories = union_categoricals([df[c] for df in tables.values()], sort_categories=True).categories
+        for df in tables.values():
+            df[c] = df[c].cat.set_categories(categories)
+    return tables
+
+
+def load_tables(data_fld, store_fld=None):
+    '''Cleaned passengers and landings tables, from the parquet store if converted (see convert), else the archives'''
+    tables = {}
+    for name, archive in ARCHIVES.items():
+        path = stored_path(store_fld, name, data_fld / archive)
+        tables[name] = pd.read_parquet(path) if path.suffix == '.parquet' else clean(read_archive(data_fld, name))
+    return share_categories(tables, AIRLINE_COLUMNS + GEO_COLUMNS)
+
+
+def convert(data_fld, store_fld):
+    '''Decode and clean the archives once into typed parquet files'''
+    store_fld.mkdir(parents=True, exist_ok=True)
+    for name in ARCHIVES:
+        df = clean(read_archive(data_fld, name))
+        df.to_parquet(store_fld / f"{name}.parquet", index=False)
+        print(f"{name}: {len(df)} rows -> {store_fld / f'{name}.parquet'}")
+
+
+def monthly_traffic(passengers, landings):
+    '''Passengers joined to the landings of passenger aircraft per month, airline and region.
+       Months without such landings have 0 landings
+    '''
+    psg = passengers.groupby(JOIN_KEYS, observed=True)[['Passenger Count']].sum()
+    landings = landings[landings['Landing Aircraft Type'] != 'Freighter']
+    lnd = landings.groupby(JOIN_KEYS, observed=True)[['Landing Count', 'Total Landed Weight']].sum()
+    df = psg.join(lnd, how='left').fillna(0).astype('int64').reset_index()
+    df['Activity Period'] = df['Activity Period'].astype('uint32')
+    df.insert(1, 'Year', (df['Activity Period'] // 100).astype('uint16'))
+    return df
+
+
+class SFOData(SharedData):
+    '''Part B tables and their monthly join, shared read-only by all sessions (as dataset.AnalysisData)'''
+    def __init__(self, tables, source=None):
+        super().__init__(source)
+        self.tables = tables
+        with stage('sfo.join', rows=len(tables['passengers'])):
+            self.monthly = monthly_traffic(tables['passengers'], tables['landings'])
+        passengers = tables['passengers']
+        self.lookups = {
+            # Airline name of each IATA code (latest in the passengers table)
+            'airline_names': passengers.drop_duplicates('Operating Airline IATA Code', keep='last')
+                .set_index('Operating Airline IATA Code')['Operating Airline'].astype(str),
+        }
+
+    def year_range(self):
+        years = self.monthly['Year']
+        return int(years.min()), int(years.max())
+
+    def monthly_slice(self, min_year, max_year, geo_summary):
+        df = self.monthly
+        return df[df['Year'].between(min_year, max_year) & df['GEO Summary'].isin(geo_summary)]
+
+
+def load_data(data_fld, store_fld=None):
+    with stage('sfo.load'):
+        source = fingerprint({name: stored_path(store_fld, name, data_fld / archive) for name, archive in ARCHIVES.items()})
+        return SFOData(load_tables(data_fld, store_fld), source)
+
+
+def per_landing(df):
+    # Passengers (enplaned and deplaned) per passenger aircraft landing (NaN without landings)
+    return df.assign(**{'Passengers per landing': (df['Passengers'] / df['Landings'].where(df['Landings'] > 0)).round(1)})
+
+
+@memoize(QUERY_CACHE)
+def monthly_series(data, min_year, max_year, geo_summary):
+    '''Passengers and landings per month in [min_year, max_year] of the flights in geo_summary (Domestic/International)'''
+    with stage('sfo.monthly_series'):
+        df = data.monthly_slice(min_year, max_year, geo_summary)
+        df = df.groupby('Activity Period')[['Passenger Count', 'Landing Count']].sum().reset_index()
+        df['Month'] = pd.to_datetime(df['Activity Period'].astype(str), format='%Y%m')
+        df = df.rename(columns={'Passenger Count': 'Passengers', 'Landing Count': 'Landings'})
+        return per_landing(df[['Month', 'Passengers', 'Landings']])
+
+
+@memoize(QUERY_CACHE)
+def top_airlines(data, min_year, max_year, geo_summary, nlargest):
+    '''Airlines with the most passengers in [min_year, max_year] of the flights in geo_summary'''
+    with stage('sfo.top_airlines'):
+        df = data.monthly_slice(min_year, max_year, geo_summary)
+        df = df.groupby('Operating Airline IATA Code', observed=True)[['Passenger Count', 'Landing Count']].sum()
+        df = df.nlargest(nlargest, 'Passenger Count').reset_index()
+        df['Airline'] = df['Operating Airline IATA Code'].map(data.lookups['airline_names']).astype(str)
+        df = df.rename(columns={'Operating Airline IATA Code': 'IATA', 'Passenger Count': 'Passengers', 'Landing Count': 'Landings'})
+        return per_landing(df[['IATA', 'Airline', 'Passengers', 'Landings']])
+
+
+@memoize(QUERY_CACHE)
+def region_passengers(data, min_year, max_year, geo_summary):
+    '''Passengers per region in [min_year, max_year] of the flights in geo_summary'''
+    with stage('sfo.region_passengers'):
+        df = data.monthly_slice(min_year, max_year, geo_summary)
+        df = df.groupby('GEO Region', observed=True)['Passenger Count'].sum().sort_values(ascending=False).reset_index()
+        return df.rename(columns={'GEO Region': 'Region', 'Passenger Count': 'Passengers'})
+
+
+if __name__ == '__main__':
+    part_b_fld = Path().absolute() / 'Data' / 'Part-B'
+    parser = argparse.ArgumentParser(description='Convert the Part B archives to typed parquet files (faster app loading)')
+    parser.add_argument('--data-fld', type=Path, default=part_b_fld, help='Folder of the archives')
+    parser.add_argument('--store-fld', type=Path, default=part_b_fld / 'Store', help='Folder of the parquet tables')
+    args = parser.parse_args()
+    convert(args.data_fld, args.store_fld)
@@ -0,0 +1,201 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+EXPORT_TABLES = ['flights', 'airlines', 'airports', 'countries', 'dates', 'days', 'months', 'seasons']
+
+COUNT_COLUMNS = [
+    'psg_scheduled_flights', 'psg_charter_flights', 'psg_total_flights',
+    'dep_scheduled_flights', 'dep_charter_flights', 'dep_total_flights',
+]
+
+# Narrowest dtypes of the table columns. Code columns are categoricals (parquet dictionary encoded),
+# columns not listed keep the inferred dtype
+SCHEMAS = {
+    'flights': {
+        'date_id': 'uint16',
+        'airport_usa_id': 'category',
+        'airport_foreign_id': 'category',
+        'airline_id': 'category',
+        'us_foreign_airline': 'uint8',
+        **{c: 'uint32' for c in COUNT_COLUMNS},
+    },
+    'dates': {
+        'id': 'uint16',
+        'day': 'uint8',
+        'month': 'uint8',
+        'year': 'uint16',
+        'day_of_week_id': 'uint8',
+        'season_id': 'uint8',
+        'day_of_year': 'uint16',
+        'week_of_year': 'uint8',
+    },
+    'days': {'id': 'uint8'},
+    'months': {'id': 'uint8'},
+    'seasons': {'id': 'uint8'},
+}
+
+# Fact table columns each business scenario reads
+SCENARIO_COLUMNS = {
+    'sc1': ['date_id', 'airport_usa_id', 'psg_total_flights'],
+    'sc2': ['date_id', 'airline_id', 'dep_scheduled_flights', 'dep_charter_flights', 'dep_total_flights'],
+    'sc3': ['date_id', 'us_foreign_airline'],
+    'sc4': ['airline_id', 'us_foreign_airline', 'psg_total_flights', 'dep_total_flights'],
+}
+
+
+def scenario_columns(*scenarios):
+    '''Union of the fact table columns needed by the given scenarios (all if none given)'''
+    scenarios = scenarios or tuple(SCENARIO_COLUMNS)
+    columns = []
+    for sc in scenarios:
+        columns.extend(c for c in SCENARIO_COLUMNS[sc] if c not in columns)
+    return columns
+
+
+def read_export(export_fld, name, columns=None, chunksize=None, typed=True):
+    '''Exported table with the dtypes of its schema (typed, if not read in chunks)'''
+    df = pd.read_csv(export_fld / f"{name}.zip", usecols=columns, chunksize=chunksize, keep_default_na=False, na_values='', encoding='utf-8')
+    return apply_schema(df, name) if typed and chunksize is None else df
+
+
+def apply_schema(df, name, schemas=SCHEMAS):
+    '''Cast the columns of a table to the dtypes of its schema, checking that integer values fit'''
+    for c, dtype in schemas.get(name, {}).items():
+        if c not in df.columns or df[c].dtype == dtype:
+            continue
+        if dtype != 'category' and len(df):
+            info = np.iinfo(dtype)
+            if df[c].min() < info.min or df[c].max() > info.max:
+                raise ValueError(f"{name}.{c} values out of the {dtype} range")
+        df[c] = df[c].astype(dtype)
+    return df
+
+
+def memory_report(export_fld, tables=EXPORT_TABLES):
+    '''Memory (MB) of the exported tables as read with the inferred dtypes and with their schema'''
+    rows = []
+    for name in tables:
+        df = read_export(export_fld, name, typed=False)
+        inferred = df.memory_usage(deep=True).sum()
+        typed = apply_schema(df, name).memory_usage(deep=True).sum()
+        rows.append({'table': name, 'rows': len(df), 'inferred_mb': inferred / 2 ** 20, 'typed_mb': typed / 2 ** 20})
+    report = pd.DataFrame(rows).set_index('table')
+    report.loc['total'] = report.sum()
+    report['saved_mb'] = report['inferred_mb'] - report['typed_mb']
+    report['saved_%'] = 100 * report['saved_mb'] / report['inferred_mb']
+    return report.round(2)
+
+
+def concat_tables(frames):
+    '''Concatenate frames of a table keeping the categorical columns categorical (union of categories)'''
+    frames = [df for df in frames if len(df)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    categoricals = {}
+    for c in frames[0].columns:
+        if frames[0][c].dtype == 'category':
+            categoricals[c] = union_categoricals([df[c] for df in frames], sort_categories=True)
+    df = pd.concat([df.drop(columns=list(categoricals)) for df in frames], ignore_index=True)
+    for c, values in categoricals.items():
+        df[c] = values
+    return df[frames[0].columns]
+
+
+def write_table(store_fld, name, df):
+    store_fld.mkdir(parents=True, exist_ok=True)
+    apply_schema(df, name).to_parquet(store_fld / f"{name}.parquet", index=False)
+
+
+def delta_fld(store_fld, name):
+    return store_fld / f"{name}.delta"
+
+
+def delta_parts(store_fld, name):
+    '''Names of the incremental parts appended to a table of the store (see etl.py append), in order.
+       Parts only apply on top of a converted table (the export already includes their rows)
+    '''
+    if not (store_fld / f"{name}.parquet").exists():
+        return []
+    return sorted(p.name for p in delta_fld(store_fld, name).glob('*.parquet'))
+
+
+def write_delta(store_fld, name, df, part):
+    fld = delta_fld(store_fld, name)
+    fld.mkdir(parents=True, exist_ok=True)
+    apply_schema(df, name).to_parquet(fld / f"{part}.parquet", index=False)
+
+
+def read_delta(store_fld, name, parts, columns=None):
+    return concat_tables([pd.read_parquet(delta_fld(store_fld, name) / p, columns=columns) for p in parts])
+
+
+def convert_export(export_fld, store_fld, tables=EXPORT_TABLES):
+    '''Convert the exported zipped csv tables to typed parquet files'''
+    for name in tables:
+        df = read_export(export_fld, name)
+        write_table(store_fld, name, df)
+        # The export already includes the rows of any incremental parts
+        for part in delta_parts(store_fld, name):
+            (delta_fld(store_fld, name) / part).unlink()
+        print(f"{name}: {len(df)} rows -> {store_fld / f'{name}.parquet'}")
+
+
+def load_table(store_fld, export_fld, name, columns=None, parts=None):
+    '''Read a table from the parquet store (with its incremental parts, all if parts is None),
+       falling back to the exported csv if not converted yet
+    '''
+    path = store_fld / f"{name}.parquet"
+    if path.exists():
+        df = pd.read_parquet(path, columns=columns)
+        parts = delta_parts(store_fld, name) if parts is None else parts
+        if parts:
+            df = concat_tables([df, read_delta(store_fld, name, parts, columns)])
+        return df
+    return read_export(export_fld, name, columns)
+
+
+def stored_path(store_fld, name, fallback):
+    '''Parquet file of a table in the store if converted (store_fld may be None), else the fallback source file'''
+    path = store_fld / f"{name}.parquet" if store_fld is not None else None
+    return path if path is not None and path.exists() else fallback
+
+
+def fingerprint(paths):
+    '''Identifies files (dict name -> path) by name, size and modification time, without reading them'''
+    sources = []
+    for name, path in paths.items():
+        stat = path.stat()
+        sources.append((name, path.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(sources)
+
+
+def source_fingerprint(store_fld, export_fld, tables=EXPORT_TABLES):
+    '''Identifies the files the tables are read from (store or export)'''
+    return fingerprint({name: stored_path(store_fld, name, export_fld / f"{name}.zip") for name in tables})
+
+
+def load_tables(store_fld, export_fld, columns=None, tables=EXPORT_TABLES, parts=None):
+    '''columns: dict table name -> list of columns to read (all columns if missing)
+       parts: dict table name -> incremental parts to read (all parts if missing)
+    '''
+    columns = columns or {}
+    parts = parts or {}
+    return {name: load_table(store_fld, export_fld, name, columns.get(name), parts.get(name)) for name in tables}
+
+
+if __name__ == '__main__':
+    part_a_fld = Path().absolute() / 'Data' / 'Part-A'
+    parser = argparse.ArgumentParser(description='Convert Part A exported tables to parquet')
+    parser.add_argument('--export', type=Path, default=part_a_fld / 'Export', help='Folder with the exported zipped csv tables')
+    parser.add_argument('--store', type=Path, default=part_a_fld / 'Store', help='Output folder for the parquet tables')
+    parser.add_argument('--report', action='store_true', help='Only print the memory of the tables with inferred and schema dtypes')
+    parser.add_argument('tables', nargs='*', default=EXPORT_TABLES, help='Tables to convert (default all)')
+    args = parser.parse_args()
+    if args.report:
+        print(memory_report(args.export, args.tables).to_string())
+    else:
+        convert_export(args.export, args.store, args.tables)
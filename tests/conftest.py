@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_FLD = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(ROOT_FLD / 'benchmarks'))
+
+import bench  # noqa: E402 (adds src to the path)
+from dataset import AnalysisData  # noqa: E402
+from store import load_tables, scenario_columns  # noqa: E402
+
+DIMS_FLD = ROOT_FLD / 'Data' / 'Part-A' / 'Export'
+# Synthetic fact table rows (bench.prepare scale)
+SCALE = 0.02
+
+
+@pytest.fixture(scope='session')
+def dims_fld():
+    return DIMS_FLD
+
+
+@pytest.fixture(scope='session')
+def data(tmp_path_factory):
+    '''Analysis data of a synthetic fact table, loaded from the exported csv tables'''
+    export_fld, store_fld = bench.prepare(tmp_path_factory.mktemp('bench'), DIMS_FLD, SCALE, store=False)
+    return AnalysisData(load_tables(store_fld, export_fld, columns={'flights': scenario_columns()}))
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cubes import DEP_COLUMNS, build_cubes, update_cubes
+
+
+def plain(flights):
+    # Fact table without categoricals, for the reference groupbys
+    return flights.astype({c: str for c in ['airport_usa_id', 'airline_id']})
+
+
+def test_airport_totals(data):
+    flights = plain(data.flights)
+    years = sorted(flights['year'].unique())
+    for min_year, max_year in [(years[0], years[-1]), (years[1], years[1]), (years[2], years[-2]), (years[-1] + 1, years[-1] + 5)]:
+        rows = flights[flights['year'].between(min_year, max_year)]
+        expected = rows.groupby('airport_usa_id')['psg_total_flights'].sum().astype('int64')
+        totals = data.airport_totals(min_year, max_year)['psg_total_flights']
+        totals.index = totals.index.astype(str)
+        pd.testing.assert_series_equal(totals.sort_index(), expected.sort_index(), check_names=False, check_index_type=False)
+
+
+def test_airline_period(data):
+    flights = plain(data.flights)
+    airline_id = flights['airline_id'].iloc[0]
+    years = sorted(flights['year'].unique())
+    rows = flights[(flights['airline_id'] == airline_id) & flights['year'].between(years[1], years[-2])]
+    expected = rows.groupby(['year', 'month', 'season'])[DEP_COLUMNS].sum().astype('int64')
+    pd.testing.assert_frame_equal(data.airline_period(airline_id, years[1], years[-2]), expected)
+    assert data.airline_period('NOPE', years[0], years[-1]).empty
+
+
+def test_airline_traffic_and_correlation(data):
+    flights = plain(data.flights)
+    expected = flights.groupby(['us_foreign_airline', 'airline_id'])[['psg_total_flights', 'dep_total_flights']].agg(['sum', 'count', 'min', 'max'])
+    traffic = data.airline_traffic((0, 1)).reset_index()
+    traffic['airline_id'] = traffic['airline_id'].astype(str)
+    pd.testing.assert_frame_equal(traffic.set_index(['us_foreign_airline', 'airline_id']), expected.astype('int64'), check_index_type=False)
+    r = np.corrcoef(flights['psg_total_flights'], flights['dep_total_flights'])[0, 1]
+    assert data.traffic_correlation().iloc[0, 1] == pytest.approx(r, rel=1e-9)
+
+
+def assert_cubes_equal(a, b):
+    for name in b:
+        if isinstance(b[name], dict):
+            for k, v in b[name].items():
+                if isinstance(v, pd.Index):
+                    assert a[name][k].equals(v), (name, k)
+                else:
+                    np.testing.assert_allclose(a[name][k], v, rtol=1e-9, err_msg=f"{name}.{k}")
+        elif isinstance(b[name], pd.Series):
+            pd.testing.assert_series_equal(a[name], b[name])
+        else:
+            pd.testing.assert_frame_equal(a[name], b[name])
+
+
+def test_update_cubes(data):
+    # Append the months after the middle of a year: the cubes of that year are rebuilt, the others kept
+    flights = data.flights
+    date_ids = np.sort(flights['date_id'].unique())
+    split = date_ids[len(date_ids) // 2 + 6]
+    before, new = flights[flights['date_id'] < split], flights[flights['date_id'] >= split]
+    assert set(before['year']) & set(new['year'])
+    assert_cubes_equal(update_cubes(build_cubes(before), flights, new), build_cubes(flights))
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('duckdb')
+
+import analytics  # noqa: E402
+import bench  # noqa: E402
+from engine import SqlData  # noqa: E402
+from part_a import PartA  # noqa: E402
+from store import convert_export, delta_parts, read_export, source_fingerprint, write_delta, write_table  # noqa: E402
+
+SCALE = 0.02
+
+
+@pytest.fixture(autouse=True)
+def no_results(monkeypatch):
+    # Computed results only, not the precomputed ones of the app
+    monkeypatch.setattr(analytics.RESULT_CACHE, 'fld', None)
+
+
+@pytest.fixture
+def flds(tmp_path, dims_fld):
+    return bench.prepare(tmp_path, dims_fld, SCALE, store=True)
+
+
+def scenario_results(data):
+    min_year, max_year = PartA.year_range(data)
+    airline_id = PartA.airline_options(data)[0].split('|')[0].strip()
+    results = []
+    for a, b in [(min_year, max_year), (min_year + 3, min_year + 3), (min_year + 2, max_year - 4)]:
+        results += analytics.busiest_airports(data, a, b, 5)
+        results += analytics.us_foreign_share(data, a, b)
+        for period_type in analytics.PERIOD_TYPES:
+            results.append(analytics.average_flights(data, airline_id, a, b, period_type, 'total'))
+    results.append(analytics.traffic_correlation(data))
+    for selection in [(0,), (1,), (0, 1)]:
+        results.append(analytics.airline_traffic(data, selection, 0.3, 10))
+    return results
+
+
+def assert_results_equal(a, b):
+    assert len(a) == len(b)
+    for x, y in zip(a, b):
+        # Same values, the categories of the id columns differ (only those of the queried rows with duckdb)
+        pd.testing.assert_frame_equal(x.reset_index(drop=True), y.reset_index(drop=True), check_categorical=False)
+
+
+def test_engines_agree(flds):
+    export_fld, store_fld = flds
+    data = analytics.load_data(store_fld, export_fld, 'pandas', mmap_fld=None)
+    sql = analytics.load_data(store_fld, export_fld, 'duckdb', mmap_fld=None)
+    assert isinstance(sql, SqlData)
+    assert_results_equal(scenario_results(sql), scenario_results(data))
+
+
+def test_refresh_after_merge(flds):
+    export_fld, store_fld = flds
+    # Last months of the fact table as an incremental part
+    flights = pd.read_parquet(store_fld / 'flights.parquet')
+    split = np.sort(flights['date_id'].unique())[-3]
+    write_table(store_fld, 'flights', flights[flights['date_id'] < split])
+    write_delta(store_fld, 'flights', flights[flights['date_id'] >= split], 'part')
+    sql = analytics.load_data(store_fld, export_fld, 'duckdb', mmap_fld=None)
+    assert sql.parts == ['part.parquet']
+    expected = scenario_results(analytics.load_data(store_fld, export_fld, 'pandas', mmap_fld=None))
+    assert not sql.refresh(store_fld, export_fld)
+
+    # store.py: the export has all the rows, the part is deleted
+    convert_export(export_fld, store_fld, ['flights'])
+    assert not delta_parts(store_fld, 'flights')
+    version = sql.version
+    assert sql.refresh(store_fld, export_fld)
+    assert sql.version == version + 1 and sql.parts == []
+    assert sql.persistent_key == SqlData.source_key(source_fingerprint(store_fld, export_fld))
+    assert_results_equal(scenario_results(sql), expected)
+    assert len(read_export(export_fld, 'flights', ['date_id'])) == len(flights)
@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+from etl import KeyEncoder
+from store import read_export
+
+
+def test_key_encoder_round_trip(dims_fld):
+    airports = read_export(dims_fld, 'airports', ['id'])
+    airlines = read_export(dims_fld, 'airlines', ['id'])
+    encoder = KeyEncoder(pd.Timestamp('1990-01-01'), airports, airlines)
+    rng = np.random.default_rng(0)
+    n = 1000
+    chunk = pd.DataFrame({
+        'data_dte': rng.choice(['01/01/1990', '05/01/2005', '12/01/2020'], n),
+        'usg_apt': rng.choice(airports['id'].to_numpy(), n),
+        'fg_apt': rng.choice(airports['id'].to_numpy(), n),
+        'carrier': rng.choice(airlines['id'].to_numpy(), n),
+    })
+    chunk.loc[:9, 'carrier'] = 'NOPE'
+    keys = encoder.encode(chunk)
+    assert (keys[:10] == -1).all() and (keys[10:] >= 0).all()
+    decoded = encoder.decode(keys[10:])
+    expected_dates = (pd.to_datetime(chunk['data_dte'][10:], format='%m/%d/%Y') - pd.Timestamp('1990-01-01')).dt.days
+    np.testing.assert_array_equal(decoded['date_id'], expected_dates.to_numpy())
+    np.testing.assert_array_equal(decoded['airport_usa_id'], chunk['usg_apt'][10:].to_numpy())
+    np.testing.assert_array_equal(decoded['airport_foreign_id'], chunk['fg_apt'][10:].to_numpy())
+    np.testing.assert_array_equal(decoded['airline_id'], chunk['carrier'][10:].to_numpy())
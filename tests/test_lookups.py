@@ -0,0 +1,19 @@
+import pandas as pd
+
+from part_a import PartA
+
+
+def test_airline_labels(data):
+    # Options of the airline selection as the notebook built them from the fact table
+    x = data.flights['airline_id'].astype(str).sort_values()
+    y = x.map(data.tables['airlines'][['id', 'name']].set_index('id').squeeze())
+    assert PartA.airline_options(data) == list(x.str.cat(y, ' | ').unique())
+
+
+def test_ranking():
+    labels = pd.Series(['JFK: John F Kennedy Intl', 'LAX: Los Angeles Intl', 'ORD: Chicago Ohare Intl'], index=[7, 3, 12])
+    # Ranking markdown as the notebook built it
+    expected = labels.reset_index(drop=True)
+    expected.index = expected.index + 1
+    expected = expected.index.map(lambda x: f"| {str(x).zfill(2)}").str.cat(expected.values, sep=' | ')
+    assert PartA.ranking(labels) == '\n\n'.join(expected)
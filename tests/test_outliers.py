@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from outliers import detect, histogram, histogram_quantiles
+
+
+def test_histogram_quantiles():
+    values = np.random.default_rng(0).lognormal(9, 1.5, 50_000).round()
+    bins, power = 2 ** 16, 1 / 8
+    counts = histogram(values, bins, power)
+    # Histograms of chunks add up
+    np.testing.assert_array_equal(sum(histogram(chunk, bins, power) for chunk in np.array_split(values, 7)), counts)
+    approx = histogram_quantiles(counts, [0.25, 0.5, 0.75], power)
+    np.testing.assert_allclose(approx, np.quantile(values, [0.25, 0.5, 0.75]), rtol=2e-3)
+
+
+@pytest.mark.parametrize('method', ['iqr', 'zscore', 'dbscan'])
+def test_detect_chunks(method):
+    values = np.random.default_rng(1).lognormal(9, 1.5, 20_000).round()
+    _, expected = detect(method, values)
+    # A generator of chunks is read once
+    _, flags = detect(method, (chunk for chunk in np.array_split(values, 7)))
+    np.testing.assert_array_equal(flags, expected)
+    assert flags.any() and len(flags) == len(values)